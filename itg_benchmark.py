@@ -0,0 +1,420 @@
+# coding: utf-8
+"""
+오더북, 잔고, 프리미엄 계산 핫패스 벤치마크
+같은 seed 면 같은 합성 스트림을 만들고, --fixture 로 BitmexRecorder 로그를 재생할 수도 있다.
+결과(처리량, 메시지당 p50/p99 지연, 최대 메모리)는 --out 파일에 한줄씩 쌓이고
+직전 결과와 비교해서 출력한다.
+
+ex) python -m itgaecoin.itg_benchmark --symbols 12 --levels 3000 --updates 100000
+    python -m itgaecoin.itg_benchmark --check-dispatcher --symbols 3 --levels 150 --updates 3000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np  # 3rd party lib(https://pypi.python.org/pypi/numpy)
+
+from itgaecoin.itg_bitmexapi import BitmexDispatcher, BitmexUtil, json_decode
+from itgaecoin.itg_bitmexreplay import BitmexReplayer
+import itgaecoin.itg_bottary as bottary
+import itgaecoin.itg_premium as premium
+
+SYMBOLS = ['XBTUSD', 'ETHUSD', 'XRPU18', 'BCHU18', 'ADAU18', 'EOSU18',
+           'LTCU18', 'TRXU18', 'XBTU18', 'XBTZ18', 'ETHU18', 'XBT7D_U110']
+
+
+def gen_l2_stream(n_symbols=4, levels=2000, updates=50000, seed=1):
+    """
+    합성 orderBookL2 스트림 (partial 후 update/insert/delete), 메시지 dict 리스트
+    id 는 빗맥과 같이 심볼번호와 가격으로 정해진다. (id 하나 = 가격 하나)
+    """
+    rnd = random.Random(seed)
+    symbols = [SYMBOLS[i % len(SYMBOLS)] + ('' if i < len(SYMBOLS) else str(i))
+               for i in range(n_symbols)]
+    msgs = []
+    live = {}  # key: (symbol, id), [side, price]
+    for s_idx, symbol in enumerate(symbols):
+        mid = 2000 * 2  # 틱(0.5) 단위 가격
+        rows = []
+        for i in range(1, levels + 1):
+            for side, tick in (('Buy', mid - i), ('Sell', mid + i)):
+                iid = 100000000 * s_idx + (100000000 - tick)
+                live[(symbol, iid)] = [side, tick / 2]
+                rows.append({'symbol': symbol, 'id': iid, 'side': side,
+                             'size': rnd.randint(1, 50000), 'price': tick / 2})
+        msgs.append({'table': 'orderBookL2', 'action': 'partial',
+                     'keys': ['symbol', 'id', 'side'], 'data': rows})
+
+    keys = list(live.keys())
+    free = []  # 삭제된 가격 (다시 insert)
+    for _ in range(updates):
+        r = rnd.random()
+        batch = rnd.randint(1, 8)
+        if r < 0.7 or not free:
+            action = 'update'
+            data = []
+            for key in rnd.sample(keys, batch):
+                if key in live:
+                    data.append({'symbol': key[0], 'id': key[1],
+                                 'side': live[key][0],
+                                 'size': rnd.randint(1, 50000)})
+        elif r < 0.85:
+            action = 'delete'
+            data = []
+            for key in rnd.sample(keys, batch):
+                if key in live:
+                    side, price = live.pop(key)
+                    free.append((key, side, price))
+                    data.append({'symbol': key[0], 'id': key[1],
+                                 'side': side})
+        else:
+            action = 'insert'
+            data = []
+            rnd.shuffle(free)
+            for key, side, price in free[:batch]:
+                live[key] = [side, price]
+                data.append({'symbol': key[0], 'id': key[1], 'side': side,
+                             'size': rnd.randint(1, 50000), 'price': price})
+            del free[:batch]
+        if data:
+            msgs.append({'table': 'orderBookL2', 'action': action,
+                         'data': data})
+    return symbols, msgs
+
+
+def gen_balance_stream(n_symbols=12, updates=50000, seed=1):
+    """
+    합성 wallet/position 스트림
+    """
+    rnd = random.Random(seed)
+    symbols = [SYMBOLS[i % len(SYMBOLS)] + ('' if i < len(SYMBOLS) else str(i))
+               for i in range(n_symbols)]
+    msgs = [
+        {'table': 'wallet', 'action': 'partial',
+         'data': [{'account': 1, 'currency': 'XBt', 'amount': 100000000}]},
+        {'table': 'position', 'action': 'partial',
+         'data': [{'account': 1, 'currency': 'XBt', 'symbol': s,
+                   'realisedPnl': 0, 'unrealisedPnl': 0, 'maintMargin': 0,
+                   'markPrice': 6000.0, 'leverage': 10} for s in symbols]},
+    ]
+    for _ in range(updates):
+        if rnd.random() < 0.02:
+            msgs.append({'table': 'wallet', 'action': 'update',
+                         'data': [{'account': 1, 'currency': 'XBt',
+                                   'amount': rnd.randint(0, 200000000)}]})
+            continue
+        row = {'account': 1, 'currency': 'XBt', 'symbol': rnd.choice(symbols),
+               'markPrice': 6000 + rnd.random() * 100}
+        if rnd.random() < 0.8:
+            row['unrealisedPnl'] = rnd.randint(-100000, 100000)
+        if rnd.random() < 0.3:
+            row['maintMargin'] = rnd.randint(0, 100000)
+        if rnd.random() < 0.1:
+            row['realisedPnl'] = rnd.randint(-100000, 100000)
+        msgs.append({'table': 'position', 'action': 'update', 'data': [row]})
+    return msgs
+
+
+def gen_spreads(count=50000, seed=1):
+    rnd = random.Random(seed)
+    ret = []
+    for _ in range(count):
+        a = 500 + rnd.random() * 10
+        b = a * (1 + (rnd.random() - 0.5) * 0.02)
+        ret.append(((a, rnd.random() * 10, a + 0.5, rnd.random() * 10),
+                    (b, rnd.random() * 10, b + 0.5, rnd.random() * 10)))
+    return ret
+
+
+def gen_premium_inputs(count=1000, n_ex=6, n_coin=20, seed=1):
+    """
+    premium_matrix 입력 (bid_px, bid_qty, ask_px, ask_qty, ex) 리스트
+    """
+    rnd = np.random.RandomState(seed)
+    ex = np.where(np.arange(n_ex) % 2, 1100.0, 1.0)  # 원화/달러 거래소 번갈아
+    ret = []
+    for _ in range(count):
+        usd = 10 + rnd.rand(1, n_coin) * 1000
+        bid = usd * (1 + (rnd.rand(n_ex, n_coin) - 0.5) * 0.02) * 1100 / ex[:, None]
+        ask = bid * (1 + rnd.rand(n_ex, n_coin) * 0.002)
+        ret.append((bid, rnd.rand(n_ex, n_coin) * 10, ask,
+                    rnd.rand(n_ex, n_coin) * 10, ex))
+    return ret
+
+
+def load_fixture(path, tables=('orderBookL2',)):
+    """
+    BitmexRecorder 로그에서 지정한 테이블 메시지만 읽는다.
+    """
+    msgs = []
+    for ts, message in BitmexReplayer(path):
+        table, action = BitmexUtil.sniff_table(message)
+        if table in tables:
+            msgs.append(json_decode(message))
+    return msgs
+
+
+def measure(func, items):
+    """
+    items 각각에 func 을 실행, 처리량(msg/s), p50/p99 지연(us)
+    (메모리는 tracemalloc 때문에 느려지므로 peak_memory 로 따로 잰다.)
+    """
+    lat = []
+    perf = time.perf_counter
+    start = perf()
+    for itm in items:
+        t = perf()
+        func(itm)
+        lat.append(perf() - t)
+    total = perf() - start
+    lat.sort()
+    ret = {
+        'count': len(items),
+        'msg_per_sec': len(items) / total if total else 0,
+        'p50_us': lat[len(lat) // 2] * 1e6 if lat else 0,
+        'p99_us': lat[min(int(len(lat) * 0.99), len(lat) - 1)] * 1e6
+        if lat else 0,
+    }
+    return ret
+
+
+def peak_memory(run):
+    """
+    run() 실행중 최대 메모리(bytes)
+    """
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def check_dispatcher(symbols, msgs, chunks=(1, 7, 0), limit=1000):
+    """
+    BitmexDispatcher 병합(conflate) 결과가 메시지를 하나씩 plexing 한 결과와 같은지 확인
+    심볼별 partial (filter 유무), 중간에 한 심볼만 다시 partial 하는 경우를
+    chunks 개씩 넣고 비우면서(0 이면 전부 넣은 뒤) 비교, 다르면 AssertionError
+    """
+    repartial = next(i for i, m in enumerate(msgs) if m['action'] == 'partial')
+    filtered = []
+    for m in msgs:
+        m = dict(m)
+        if m['action'] == 'partial':
+            m['filter'] = {'symbol': m['data'][0]['symbol']}
+        filtered.append(m)
+    cases = {
+        'partial': msgs,
+        'partial_filter': filtered,
+        'repartial': msgs[:len(msgs) // 2] + [msgs[repartial]] +
+        msgs[len(msgs) // 2:],
+    }
+    for name, case in cases.items():
+        ref = BitmexUtil.WsOrderBooks(BitmexUtil.WsOrderBook)
+        for m in case:
+            m = json.loads(json.dumps(m))
+            ref.plexing(m['table'], m['action'], m)
+        raw = [json.dumps(m) for m in case]
+        for chunk in chunks:
+            chunk = chunk or len(raw)
+            books = BitmexUtil.WsOrderBooks(BitmexUtil.WsOrderBook)
+            dispatcher = BitmexDispatcher()
+            dispatcher.register('orderBookL2', books.plexing)
+            for i in range(0, len(raw), chunk):
+                for message in raw[i:i + chunk]:
+                    dispatcher.put(message)
+                while dispatcher.dispatch(timeout=0):
+                    pass
+            for symbol in symbols:
+                if (list(books.gen_buys(symbol, limit)) !=
+                        list(ref.gen_buys(symbol, limit)) or
+                        list(books.gen_slls(symbol, limit)) !=
+                        list(ref.gen_slls(symbol, limit))):
+                    raise AssertionError('dispatcher mismatch: %s chunk=%d %s'
+                                         % (name, chunk, symbol))
+            print('%-15s chunk %-7d ok (merged %d)'
+                  % (name, chunk, dispatcher.merged))
+
+
+def bench_books(symbols, msgs, book_class, limit=20):
+    """
+    WsOrderBooks.plexing, 이어서 gen_buys/gen_slls 읽기
+    """
+    # 메시지 dict 는 plexing 에서 바뀔 수 있으므로 매번 새로 만든다.
+    raw = [json.dumps(m) for m in msgs]
+
+    def play():
+        books = BitmexUtil.WsOrderBooks(book_class)
+        for m in map(json_decode, raw):
+            books.plexing(m['table'], m['action'], m)
+        return books
+
+    decoded = [json_decode(m) for m in raw]
+    books = BitmexUtil.WsOrderBooks(book_class)
+    ret = {'plexing': measure(
+        lambda m: books.plexing(m['table'], m['action'], m), decoded)}
+
+    def read(symbol):
+        for itm in books.gen_buys(symbol, limit):
+            pass
+        for itm in books.gen_slls(symbol, limit):
+            pass
+    ret['gen_buys_slls'] = measure(read, symbols * 2000)
+    ret['depth_view'] = measure(
+        lambda s: books.depth_view(s, 'Buy', limit).impact_prices(
+            [1000, 10000, 100000]), symbols * 2000)
+    ret['plexing']['peak_bytes'] = peak_memory(play)
+    ret['plexing']['bytes_per_level'] = book_memory(msgs, book_class)
+    return ret
+
+
+def book_memory(msgs, book_class):
+    """
+    partial 로 만든 오더북의 호가당 메모리(bytes), 메시지 객체를 공유하지 않도록
+    행을 복사해서 넣고 원본 행은 지운 뒤 잰다.
+    """
+    rows = [m for m in msgs if m['action'] == 'partial'][0]['data']
+    raw = json.dumps(rows)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    book = book_class(rows[0]['symbol'])
+    copied = json.loads(raw)
+    book.load_partial(copied)
+    del copied
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used / len(rows)
+
+
+def bench_balance(msgs):
+    raw = [json.dumps(m) for m in msgs]
+    decoded = [json_decode(m) for m in raw]
+    bal = BitmexUtil.WsBalance()
+
+    def step(m):
+        bal.plexing(m['table'], m['action'], m)
+        bal.front_wallet()
+
+    ret = {'plexing_front_wallet': measure(step, decoded)}
+
+    def play():
+        b = BitmexUtil.WsBalance()
+        for m in map(json_decode, raw):
+            b.plexing(m['table'], m['action'], m)
+            b.front_wallet()
+    ret['plexing_front_wallet']['peak_bytes'] = peak_memory(play)
+    return ret
+
+
+def bench_premium(spreads):
+    ret = {'check_premium': measure(
+        lambda ab: bottary.check_premium(ab[0], ab[1], 1100.0, 1.0), spreads)}
+    ret['check_bottary'] = measure(
+        lambda ab: bottary.check_bottary(*(ab[0] + ab[1] + (1100.0, 1.0))),
+        spreads)
+    # 6 거래소 x 20 코인 (순서쌍 600개) 한번에
+    ret['premium_matrix_6x20'] = measure(
+        lambda arrs: premium.top_premiums(premium.premium_matrix(*arrs), 10),
+        gen_premium_inputs(max(len(spreads) // 100, 1)))
+    return ret
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_last(path):
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def print_results(results, last=None):
+    prev = last['results'] if last else {}
+    for group, benches in results.items():
+        for name, r in benches.items():
+            line = '%-32s %10.0f msg/s  p50 %8.2fus  p99 %8.2fus' % (
+                group + '.' + name, r['msg_per_sec'], r['p50_us'], r['p99_us'])
+            if 'peak_bytes' in r:
+                line += '  peak %6.1fMB' % (r['peak_bytes'] / 1e6)
+            if 'bytes_per_level' in r:
+                line += '  %5.0fB/level' % r['bytes_per_level']
+            p = prev.get(group, {}).get(name)
+            if p and p['msg_per_sec']:
+                line += '  (%+.1f%% vs %s)' % (
+                    (r['msg_per_sec'] / p['msg_per_sec'] - 1) * 100,
+                    last['version'])
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='itgaecoin hot path benchmark')
+    parser.add_argument('--symbols', type=int, default=4)
+    parser.add_argument('--levels', type=int, default=2000,
+                        help='partial levels per side')
+    parser.add_argument('--updates', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fixture', help='BitmexRecorder log to replay')
+    parser.add_argument('--legacy', action='store_true',
+                        help='also run the legacy WsOrderBook engine')
+    parser.add_argument('--compact', action='store_true',
+                        help='also run the WsCompactOrderBook engine')
+    parser.add_argument('--out', default='bench_results.jsonl')
+    parser.add_argument('--check-dispatcher', action='store_true',
+                        help='only check BitmexDispatcher conflation '
+                             'against direct plexing')
+    args = parser.parse_args()
+
+    if args.fixture:
+        msgs = load_fixture(args.fixture)
+        symbols = sorted({t['symbol'] for m in msgs for t in m['data']})
+    else:
+        symbols, msgs = gen_l2_stream(args.symbols, args.levels, args.updates,
+                                      args.seed)
+
+    if args.check_dispatcher:
+        check_dispatcher(symbols, msgs)
+        return
+
+    results = {
+        'books': bench_books(symbols, msgs, BitmexUtil.WsSortedOrderBook),
+        'balance': bench_balance(gen_balance_stream(
+            len(SYMBOLS), args.updates, args.seed)),
+        'premium': bench_premium(gen_spreads(args.updates, args.seed)),
+    }
+    if args.legacy:
+        results['books_legacy'] = bench_books(symbols, msgs,
+                                              BitmexUtil.WsOrderBook)
+    if args.compact:
+        results['books_compact'] = bench_books(symbols, msgs,
+                                               BitmexUtil.WsCompactOrderBook)
+
+    last = load_last(args.out)
+    record = {
+        'time': datetime.datetime.now().isoformat(),
+        'version': git_version(),
+        'params': vars(args),
+        'results': results,
+    }
+    print_results(results, last)
+    with open(args.out, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# coding: utf-8
+import datetime
+import json
+import urllib.parse
+
+import aiohttp  # 3rd party lib(https://pypi.python.org/pypi/aiohttp)
+import yarl  # 3rd party lib(https://pypi.python.org/pypi/yarl), aiohttp 의존성
+
+from itgaecoin.itg_bitmexapi import BitmexUtil, REQ_HEADER, json_decode
+
+
+class BitmexAsyncAPI:
+    """
+    BitmexAPI 의 asyncio 버전, 모든 메소드는 await 로 호출
+    여러 계정/심볼의 주문, 포지션 조회를 하나의 이벤트루프에서 겹쳐서 수행
+
+    session 을 넘기면 공유해서 사용, 없으면 첫 요청때 생성 (close 로 정리)
+    """
+
+    def __init__(self, _apikey, _secret, session=None,
+                 base_url='https://www.bitmex.com'):
+        self.apikey = _apikey
+        self.secret = _secret
+        self.base_url = base_url
+        self.base_pre = '/api/v1'
+        self.x_limit = 0
+        self.x_remain = 0
+        self.x_reset = 0
+        self.last_status = 200
+        self.session = session  # type: aiohttp.ClientSession
+        self._own_session = session is None
+
+    async def close(self):
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _req(self, method, path, query_dict, body_dict, is_auth):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        rq_header = dict(REQ_HEADER)
+        # query str
+        query_str = ''
+        if query_dict:
+            query_str = '?' + urllib.parse.urlencode(query_dict)
+
+        # body
+        body_str = ''
+        if body_dict:
+            body_str = json.dumps(body_dict)
+
+        # auth
+        if is_auth:
+            rq_header.update(BitmexUtil.auth_headers(
+                self.apikey, self.secret, method, self.base_pre + path,
+                query_str, body_str))
+
+        # req, 서명한 쿼리 문자열 그대로 보내도록 (yarl 이 다시 인코딩하지 않게)
+        url_str = self.base_url + self.base_pre + path + query_str
+        async with self.session.request(
+                method, yarl.URL(url_str, encoded=True), headers=rq_header,
+                data=body_str.encode('utf-8') if body_str else None) as res:
+            self.last_status = res.status
+
+            self.x_limit = res.headers.get('x-ratelimit-limit')
+            self.x_remain = res.headers.get('x-ratelimit-remaining')
+            self.x_reset = res.headers.get('x-ratelimit-reset')
+
+            res.raise_for_status()  # urlopen 과 같이 오류응답은 예외
+            txt = await res.text()
+        return json_decode(txt)
+
+    async def get_position(self, symbol='XBTUSD'):
+        return await self._req('GET', '/position',
+                               {'filter': json.dumps({"symbol": symbol})},
+                               None, True)
+
+    # 레버리지 조절
+    async def post_position_leverage(self, leverage, symbol='XBTUSD'):
+        l = {
+            'symbol': symbol,
+            'leverage': leverage,
+        }
+        return await self._req('POST', '/position/leverage', None, l, True)
+
+    async def get_user_wallet(self, currency='XBt'):
+        return await self._req('GET', '/user/wallet', {'currency': currency},
+                               None, True)
+
+    # 주문 지정가로만, 음수는 매도
+    async def post_order(self, order_qty, price, symbol='XBTUSD',
+                         is_post_only=False):
+        order = BitmexUtil.order_dict(order_qty, price, symbol, is_post_only)
+        return await self._req('POST', '/order', None, order, True)
+
+    # 벌크주문
+    async def post_order_bulk(self, qtys, prices, symbol='XBTUSD',
+                              is_post_only=False):
+        bulk = [BitmexUtil.order_dict(order_qty, price, symbol, is_post_only)
+                for order_qty, price in zip(qtys, prices)]
+        orders = {
+            'orders': json.dumps(bulk)
+        }
+        return await self._req('POST', '/order/bulk', None, orders, True)
+
+
+class BitmexAsyncWebsocket:
+    """
+    BitmexWebsocket 의 asyncio 버전, 스레드/Queue 없이 async for 로 수신
+    ex) ws = BitmexAsyncWebsocket(apikey, secret)
+        await ws.run_with_topics(BitmexUtil.normal_topics())
+        async for d in ws: ...
+    tables 를 지정하면 나머지 테이블 메시지는 파싱하지 않고 버린다.
+    """
+
+    def __init__(self, _apikey, _secret, tables=None, session=None,
+                 base_url='wss://www.bitmex.com/realtime'):
+        self.base_url = base_url
+        self.ws = None  # type: aiohttp.ClientWebSocketResponse
+        self.apikey = _apikey
+        self.secret = _secret
+        self.topics = []
+        self.tables = set(tables) if tables is not None else None
+        self.skipped = 0  # tables 필터로 버린 메시지 수
+        self.session = session  # type: aiohttp.ClientSession
+        self._own_session = session is None
+
+    async def run_with_topics(self, topics):
+        self.topics = topics
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        self.ws = await self.session.ws_connect(self.base_url, heartbeat=30)
+
+        # auth부터 실시한다.
+        expires = int(datetime.datetime.now().timestamp() * 1000)
+        sig = BitmexUtil.gen_signature(self.secret, 'GET', '/realtime', '', '',
+                                       expires)
+        await self.send_message('authKey', [self.apikey, expires, sig])
+
+        # topics 를 요청
+        await self.send_message('subscribe', self.topics)
+
+    async def send_message(self, op, args):
+        await self.ws.send_str(json.dumps({'op': op, 'args': args}))
+
+    def __aiter__(self):
+        return self._iter_messages()
+
+    async def _iter_messages(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                if msg.type in (aiohttp.WSMsgType.CLOSED,
+                                aiohttp.WSMsgType.ERROR):
+                    break
+                continue
+            if self.tables is not None:
+                table, action = BitmexUtil.sniff_table(msg.data)
+                if table is not None and table not in self.tables:
+                    self.skipped += 1
+                    continue
+            yield json_decode(msg.data)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
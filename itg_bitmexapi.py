@@ -3,16 +3,43 @@ import datetime
 import hashlib
 import hmac
 import json
+import re
 import ssl
 import urllib
+import urllib.error
 import urllib.parse
 import urllib.request
 import threading
 import queue
-import http.client
 import bisect
+import collections
+from array import array
+import concurrent.futures
+import heapq
+import itertools
+import time
 import websocket  # 3rd party lib(https://pypi.python.org/pypi/websocket-client)
+from sortedcontainers import SortedDict  # 3rd party lib(https://pypi.python.org/pypi/sortedcontainers)
 
+from itgaecoin.itg_httppool import HTTPPool
+
+# 빠른 json 디코더가 설치되어 있으면 사용, 없으면 표준 json
+try:
+    import orjson  # 3rd party lib(https://pypi.python.org/pypi/orjson)
+    json_decode = orjson.loads
+except ImportError:
+    json_decode = json.loads
+
+REQ_HEADER = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 ('
+                  'KHTML, '
+                  'like Gecko) Chrome/60.0.3112.113 Safari/537.36',
+    'accept': 'application/json',
+    'content-type': 'application/json',
+}
+
+# 빗맥 메시지는 table, action 이 맨 앞에 온다 {"table":"..","action":"..",
+TABLE_PATTERN = re.compile(r'\{\s*"table"\s*:\s*"(\w+)"\s*,\s*"action"\s*:\s*"(\w+)"')
 
 
 
@@ -24,26 +51,28 @@ class BitmexAPI:
     메소드는 Method 와 path 의 조합이며 '_'로 구분됨
     구현되지 않은 API들은 url 참조하여 직접 작성
     모두 블로킹 모드로 작동
+    요청은 keep-alive 커넥션 풀(HTTPPool)로 보내며 pool_size 만큼 동시요청 가능,
+    timeout 은 요청별 소켓 타임아웃(초)
     """
 
-    def __init__(self, _apikey, _secret):
+    def __init__(self, _apikey, _secret, pool_size=4, timeout=10,
+                 base_url='https://www.bitmex.com'):
         self.apikey = _apikey
         self.secret = _secret
-        self.base_url = 'https://www.bitmex.com'
+        self.base_url = base_url
         self.base_pre = '/api/v1'
         self.x_limit = 0
         self.x_remain =0
         self.x_reset = 0
         self.last_status = 200
-
-    def _req(self, method, path, query_dict, body_dict, is_auth):
-        rq_header = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 ('
-                          'KHTML, '
-                          'like Gecko) Chrome/60.0.3112.113 Safari/537.36',
-            'accept': 'application/json',
-            'content-type': 'application/json',
-        }
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pool = None  # type: HTTPPool
+        self.scheduler = BitmexRateScheduler()  # None 이면 제한 관리 안함
+
+    def _req(self, method, path, query_dict, body_dict, is_auth,
+             priority=None):
+        rq_header = dict(REQ_HEADER)
         # query str
         query_str = ''
         if query_dict:
@@ -56,32 +85,49 @@ class BitmexAPI:
 
         # auth
         if is_auth:
-            expires = int(datetime.datetime.now().timestamp() * 1000)
-            sig = BitmexUtil.gen_signature(
-                self.secret, method, self.base_pre + path, query_str, body_str,
-                expires)
-            rq_header['api-expires'] = str(expires)
-            rq_header['api-key'] = self.apikey
-            rq_header['api-signature'] = sig
-
-        # req
-        url_str = self.base_url + self.base_pre + path + query_str
-        if body_str == '':
-            req = urllib.request.Request(url_str, method=method,
-                                         headers=rq_header)
-        else:
-            req = urllib.request.Request(url_str, method=method,
-                                         headers=rq_header,
-                                         data=body_str.encode('utf-8'))
-        res = urllib.request.urlopen(req) # type: http.client.HTTPResponse
+            rq_header.update(BitmexUtil.auth_headers(
+                self.apikey, self.secret, method, self.base_pre + path,
+                query_str, body_str))
+
+        # req (base_url 이 바뀌면 풀을 새로 만든다)
+        if self.pool is None or self.pool.base_url != self.base_url:
+            if self.pool is not None:
+                self.pool.close()
+            self.pool = HTTPPool(self.base_url, self.pool_size)
+
+        # 요청 제한 예산이 허락할 때까지 대기 (취소, 포지션 요청 우선)
+        scheduler = self.scheduler
+        if scheduler is not None:
+            if priority is None:
+                priority = scheduler.classify(method, path)
+            scheduler.acquire(priority)
+        try:
+            res = self.pool.request(
+                method, self.base_pre + path + query_str,
+                body_str.encode('utf-8') if body_str else None, rq_header,
+                self.timeout)
+        except urllib.error.HTTPError as e:
+            self._update_limit(e.code, e.headers)
+            raise
+        except Exception:
+            if scheduler is not None:
+                scheduler.release(None, None, None)
+            raise
+
+        self._update_limit(res.status, res.headers)
+        return res
 
-        self.last_status = res.status
+    def _update_limit(self, status, headers):
+        self.last_status = status
 
-        self.x_limit = res.getheader('x-ratelimit-limit')
-        self.x_remain = res.getheader('x-ratelimit-remaining')
-        self.x_reset = res.getheader('x-ratelimit-reset')
+        self.x_limit = headers.get('x-ratelimit-limit')
+        self.x_remain = headers.get('x-ratelimit-remaining')
+        self.x_reset = headers.get('x-ratelimit-reset')
 
-        return res
+        if self.scheduler is not None:
+            self.scheduler.release(self.x_limit, self.x_remain, self.x_reset)
+            if status == 429:
+                self.scheduler.penalize(headers.get('retry-after'))
 
     # https://www.bitmex.com/api/explorer/
     # explorer 참고하여 비슷한 형식으로 작성하면 된다.
@@ -110,14 +156,7 @@ class BitmexAPI:
 
     # 주문 지정가로만, 음수는 매도
     def post_order(self, order_qty, price, symbol='XBTUSD', is_post_only=False):
-        order = {
-            'symbol': symbol,
-            'orderQty': order_qty,
-            'price': price,
-        }
-        if is_post_only: # 테이킹 주문 방지 (무조건 메이커)
-            order['execInst'] = 'ParticipateDoNotInitiate'
-
+        order = BitmexUtil.order_dict(order_qty, price, symbol, is_post_only)
         res = self._req('POST', '/order', None, order, True)
         txt = res.read().decode('utf-8')
         return json.loads(txt)
@@ -125,16 +164,8 @@ class BitmexAPI:
     # 벌크주문
     def post_order_bulk(self, qtys, prices, symbol='XBTUSD',
                         is_post_only=False):
-        bulk = []
-        for i, (order_qty, price) in enumerate(zip(qtys, prices)):
-            order = {
-                'symbol': symbol,
-                'orderQty': order_qty,
-                'price': price,
-            }
-            if is_post_only: # 테이킹 주문 방지 (무조건 메이커)
-                order['execInst'] = 'ParticipateDoNotInitiate'
-            bulk.append(order)
+        bulk = [BitmexUtil.order_dict(order_qty, price, symbol, is_post_only)
+                for order_qty, price in zip(qtys, prices)]
         orders = {
             'orders': json.dumps(bulk)
         }
@@ -142,19 +173,291 @@ class BitmexAPI:
         txt = res.read().decode('utf-8')
         return json.loads(txt)
 
+    # 벌크정정, amends: [{'orderID':.., 'orderQty':.., 'price':..}, ...]
+    def put_order_bulk(self, amends):
+        orders = {
+            'orders': json.dumps(amends)
+        }
+        res = self._req('PUT', '/order/bulk', None, orders, True)
+        txt = res.read().decode('utf-8')
+        return json.loads(txt)
+
+    # 주문취소, 여러개 가능
+    def delete_order(self, order_ids):
+        res = self._req('DELETE', '/order', None,
+                        {'orderID': json.dumps(order_ids)}, True)
+        txt = res.read().decode('utf-8')
+        return json.loads(txt)
+
+
+class BitmexOrderBatcher:
+    """
+    짧은 시간(window 초)안에 들어온 주문, 정정, 취소를 모아 벌크 요청 하나로 전송
+    각 호출은 concurrent.futures.Future 를 바로 반환하고, 결과(주문 dict)는 future 로 전달
+    (max_batch 개가 모이면 window 를 기다리지 않고 바로 전송)
+    ex) futs = [batcher.post_order(10, pr) for pr in prices]
+        orders = [f.result() for f in futs]
+    """
+    def __init__(self, api, window=0.005, max_batch=10):
+        self.api = api  # type: BitmexAPI
+        self.window = window
+        self.max_batch = max_batch
+        self.sent = 0      # 보낸 벌크 요청 수
+        self.batched = 0   # 벌크로 묶인 호출 수
+        self._pending = []  # (kind, item, future)
+        self._first = 0.0   # 모으기 시작한 시각
+        self._cond = threading.Condition()
+        self._closed = False
+        th = threading.Thread(target=self._run, daemon=True)
+        th.start()
+
+    def _put(self, kind, item):
+        fut = concurrent.futures.Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('batcher closed')
+            if not self._pending:
+                self._first = time.time()
+            self._pending.append((kind, item, fut))
+            self._cond.notify_all()
+        return fut
+
+    def post_order(self, order_qty, price, symbol='XBTUSD', is_post_only=False):
+        return self._put('post', (order_qty, price, symbol, is_post_only))
+
+    def amend_order(self, order_id, order_qty=None, price=None):
+        amend = {'orderID': order_id}
+        if order_qty is not None:
+            amend['orderQty'] = order_qty
+        if price is not None:
+            amend['price'] = price
+        return self._put('amend', amend)
+
+    def cancel_order(self, order_id):
+        return self._put('cancel', order_id)
+
+    def close(self):
+        """
+        남은 요청을 보내고 종료
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                while (self._pending and not self._closed and
+                       len(self._pending) < self.max_batch):
+                    left = self._first + self.window - time.time()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                if not self._pending and self._closed:
+                    return
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+                self._first = time.time()
+
+            # 호출한 쪽에서 취소한 future 는 보내지 않는다 (이후로는 취소 불가)
+            batch = [(kind, item, fut) for kind, item, fut in batch
+                     if fut.set_running_or_notify_cancel()]
+            # 취소, 정정, 신규 순서로 전송
+            for kind in ('cancel', 'amend', 'post'):
+                items = [(item, fut) for k, item, fut in batch if k == kind]
+                if items:
+                    self._send(kind, items)
+
+    def _send(self, kind, items):
+        self.batched += len(items)
+        try:
+            if kind == 'post':
+                # 심볼, post_only 가 같은 주문끼리 post_order_bulk 하나로
+                groups = {}
+                for item, fut in items:
+                    groups.setdefault(item[2:], []).append((item, fut))
+                for (symbol, is_post_only), group in groups.items():
+                    self.sent += 1
+                    try:
+                        ret = self.api.post_order_bulk(
+                            [item[0] for item, fut in group],
+                            [item[1] for item, fut in group],
+                            symbol, is_post_only)
+                    except Exception as e:
+                        for item, fut in group:
+                            fut.set_exception(e)
+                        continue
+                    if len(ret) != len(group):
+                        e = RuntimeError('bulk result mismatch %s != %s' %
+                                         (len(ret), len(group)))
+                        for item, fut in group:
+                            fut.set_exception(e)
+                        continue
+                    for (item, fut), order in zip(group, ret):
+                        fut.set_result(order)
+                return
+
+            self.sent += 1
+            if kind == 'amend':
+                ret = self.api.put_order_bulk([item for item, fut in items])
+                ids = [item['orderID'] for item, fut in items]
+            else:
+                ret = self.api.delete_order([item for item, fut in items])
+                ids = [item for item, fut in items]
+        except Exception as e:
+            for item, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        # 정정, 취소 결과는 orderID 로 찾아서 전달
+        by_id = {order.get('orderID'): order for order in ret}
+        for iid, (item, fut) in zip(ids, items):
+            if iid in by_id:
+                fut.set_result(by_id[iid])
+            else:
+                fut.set_exception(KeyError(iid))
+
+
+class BitmexRateScheduler:
+    """
+    x-ratelimit 헤더 기반 요청 스케줄러, BitmexAPI._req 앞에서 동작
+    남은 예산이 low_water 이하면 reset 시각까지 균등 간격으로 보내고,
+    마지막 reserve 개 예산은 신규주문(ORDER)이 쓰지 못하게 남겨둔다.
+    대기중인 요청은 우선순위(CANCEL < POSITION < ORDER)순으로 나간다.
+    """
+    CANCEL = 0    # 주문취소
+    POSITION = 1  # 레버리지, 포지션 및 조회
+    ORDER = 2     # 신규주문, 정정
+
+    def __init__(self, reserve=5, low_water=10):
+        self.reserve = reserve
+        self.low_water = low_water
+        self.limit = None
+        self.remain = None  # 모르면 제한없이 보냄
+        self.reset = 0.0    # 예산이 다시 채워지는 시각 (unix time)
+        self.inflight = 0
+        self.last_sent = 0.0
+        self.waits = {}     # key: priority, [count, total, max] 대기시간(초)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def classify(cls, method, path):
+        if method == 'DELETE':
+            return cls.CANCEL
+        if path.startswith('/order'):
+            return cls.ORDER
+        return cls.POSITION
+
+    def _delay(self, priority, now):
+        """
+        지금부터 보낼 수 있을 때까지 남은 시간(초), 0 이하면 바로 보냄
+        """
+        if self.remain is None:
+            return 0
+        if now >= self.reset:
+            budget = (self.limit or self.remain) - self.inflight
+        else:
+            budget = self.remain - self.inflight
+        floor = self.reserve if priority >= self.ORDER else 0
+        if budget <= floor:
+            if now >= self.reset:  # 정보 갱신 대기 (응답중인 요청)
+                return 0.1
+            return self.reset - now
+        if budget > self.low_water or now >= self.reset:
+            return 0
+        gap = (self.reset - now) / (budget - floor)
+        return self.last_sent + gap - now
+
+    def acquire(self, priority=POSITION):
+        """
+        보내도 될 때까지 블로킹, 대기한 시간(초)을 반환
+        """
+        start = time.time()
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._heap, entry)
+            self._cond.notify_all()
+            while True:
+                now = time.time()
+                if self._heap[0] == entry:
+                    delay = self._delay(priority, now)
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._heap)
+            self.inflight += 1
+            self.last_sent = now
+
+            waited = now - start
+            w = self.waits.setdefault(priority, [0, 0.0, 0.0])
+            w[0] += 1
+            w[1] += waited
+            w[2] = max(w[2], waited)
+            self._cond.notify_all()
+        return waited
+
+    def release(self, limit, remain, reset):
+        """
+        응답 수신후 호출, 헤더값이 None 이면 예산 정보는 그대로
+        """
+        with self._cond:
+            self.inflight -= 1
+            if remain is not None:
+                self.remain = int(remain)
+            if limit is not None:
+                self.limit = int(limit)
+            if reset is not None:
+                self.reset = float(reset)
+            self._cond.notify_all()
+
+    def penalize(self, retry_after):
+        """
+        429 응답시 retry_after(초) 동안 보내지 않는다
+        """
+        with self._cond:
+            self.remain = 0
+            self.reset = time.time() + float(retry_after or 1)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'remain': self.remain,
+                'reset': self.reset,
+                'inflight': self.inflight,
+                'queued': len(self._heap),
+                'wait': {p: {'count': w[0], 'avg': w[1] / w[0], 'max': w[2]}
+                         for p, w in self.waits.items()},
+            }
+
 
 class BitmexWebsocket:
     """
     웹소켓 API구현, 바로 Auth를 실시하므로 apikey, secret 정확히 넣어줄 것,
     실시간 수신데이터는 백그라운드 스레드에서 Queue에 담는다.
+    tables 를 지정하면 전체 파싱 전에 table 만 읽어서 나머지 테이블은 버리고,
+    decode=True 이면 수신스레드에서 디코딩한 dict 를 담는다 (기본은 원문 문자열)
     """
-    def __init__(self, _apikey, _secret, _get_queue=queue.Queue()):
-        self.base_url = 'wss://www.bitmex.com/realtime'
+    def __init__(self, _apikey, _secret, _get_queue=None, tables=None,
+                 decode=False, base_url='wss://www.bitmex.com/realtime'):
+        self.base_url = base_url
         self.ws = None  # type: websocket.WebSocketApp
         self.apikey = _apikey
         self.secret = _secret
         self.topics = []
-        self.msg_q = _get_queue
+        self.msg_q = _get_queue if _get_queue is not None else queue.Queue()
+        self.tables = set(tables) if tables is not None else None
+        self.decode = decode
+        self.skipped = 0  # tables 필터로 버린 메시지 수
+        self.recorder = None  # 수신 원문 기록 (itg_bitmexreplay.BitmexRecorder)
 
     def get_message_queue(self):
         return self.msg_q
@@ -194,6 +497,16 @@ class BitmexWebsocket:
         self.send_message('subscribe', self.topics)
 
     def _on_message(self, ws, message):
+        if self.recorder is not None:
+            self.recorder.write(message)
+        if self.tables is not None:
+            table, action = BitmexUtil.sniff_table(message)
+            # table 없는 메시지(subscribe 응답, 에러 등)는 항상 전달
+            if table is not None and table not in self.tables:
+                self.skipped += 1
+                return
+        if self.decode:
+            message = json_decode(message)
         self.msg_q.put(message)
 
     def _on_error(self, ws, error):
@@ -204,6 +517,210 @@ class BitmexWebsocket:
         self.ws.close()
 
 
+class BitmexDispatcher:
+    """
+    웹소켓 수신 메시지를 테이블별 핸들러로 분배하는 큐,
+    BitmexWebsocket 의 _get_queue 자리에 넣어 사용 (수신스레드가 put 호출)
+    conflate 테이블(기본 orderBookL2)은 밀린 델타를 키별로 병합하여 최신상태만 전달
+    maxsize > 0 이면 유한 큐, 가득 찼을 때 policy 에 따라
+    'block'(수신스레드 대기), 'drop_new'(새 메시지 버림), 'drop_old'(오래된 메시지 버림)
+    (주의점: 소비 스레드는 하나라고 전제함)
+    """
+    DEFAULT_KEYS = {'orderBookL2': ('symbol', 'id', 'side')}
+
+    def __init__(self, maxsize=0, policy='block', conflate=('orderBookL2',)):
+        if policy not in ('block', 'drop_new', 'drop_old'):
+            raise ValueError('unknown policy: %s' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.conflate = set(conflate)
+        self.handlers = {}  # key: table, [handler(table, action, d)]
+        self.keys = dict(BitmexDispatcher.DEFAULT_KEYS)  # key: table, 키 필드
+        self.received = 0
+        self.merged = 0     # 병합되어 전달하지 않은 행 수
+        self.dropped = {}   # key: table, 버린 메시지 수
+        self._q = collections.deque()      # (table, action, d)
+        self._dirty = collections.deque()  # 병합 대기중인 테이블
+        # key: table, {'partial': {symbol: {key: row}},
+        #              'rows': {symbol: {key: [deleted, action, row]}}}
+        self._pending = {}
+        self._ready = collections.deque()  # 소비 스레드 전용
+        self._cond = threading.Condition()
+
+    def register(self, table, handler):
+        """
+        table 메시지 수신시 handler(table, action, d) 호출
+        table 이 None 이면 table 없는 메시지 (subscribe 응답, 에러 등)
+        """
+        self.handlers.setdefault(table, []).append(handler)
+
+    def put(self, message):
+        if isinstance(message, (str, bytes)):
+            d = json_decode(message)
+        else:
+            d = message
+        table = d.get('table')
+        action = d.get('action')
+
+        with self._cond:
+            self.received += 1
+            if table in self.conflate and (
+                    action == 'partial' or table in self.keys):
+                self._merge(table, action, d)
+                self._cond.notify_all()
+                return
+
+            if 0 < self.maxsize <= len(self._q):
+                if self.policy == 'drop_new':
+                    self._drop(table)
+                    return
+                elif self.policy == 'drop_old':
+                    self._drop(self._q.popleft()[0])
+                else:
+                    while 0 < self.maxsize <= len(self._q):
+                        self._cond.wait()
+            self._q.append((table, action, d))
+            self._cond.notify_all()
+
+    def _drop(self, table):
+        self.dropped[table] = self.dropped.get(table, 0) + 1
+
+    def _merge(self, table, action, d):
+        if 'keys' in d:
+            self.keys[table] = tuple(d['keys'])
+        fields = self.keys[table]
+
+        pend = self._pending.get(table)
+        if pend is None:
+            # 심볼별 대기분 (partial 은 구독마다, 즉 심볼마다 따로 온다)
+            pend = self._pending[table] = {'partial': {}, 'rows': {}}
+            self._dirty.append(table)
+
+        if action == 'partial':
+            # partial 에 들어있는 심볼의 이전 대기분만 스냅샷으로 대체
+            symbol = (d.get('filter') or {}).get('symbol')
+            if symbol is not None:
+                symbols = {symbol}
+            elif d['data']:
+                symbols = {t.get('symbol') for t in d['data']}
+            else:  # 심볼을 알 수 없는 빈 partial 은 테이블 전체
+                symbols = set(pend['partial']) | set(pend['rows']) | {None}
+            for symbol in symbols:
+                self.merged += len(pend['partial'].pop(symbol, ()))
+                self.merged += len(pend['rows'].pop(symbol, ()))
+                pend['partial'][symbol] = {}
+            for t in d['data']:
+                pend['partial'][t.get('symbol')][
+                    tuple(t[f] for f in fields)] = t
+            return
+
+        for t in d['data']:
+            symbol = t.get('symbol')
+            k = tuple(t[f] for f in fields)
+            snapshot = pend['partial'].get(symbol)
+            if snapshot is not None:
+                # 스냅샷 대기중이면 스냅샷에 바로 반영
+                if action == 'delete':
+                    snapshot.pop(k, None)
+                elif action == 'update':
+                    if k in snapshot:
+                        snapshot[k].update(t)
+                else:
+                    snapshot[k] = t
+                self.merged += 1
+                continue
+
+            rows = pend['rows'].get(symbol)
+            if rows is None:
+                rows = pend['rows'][symbol] = {}
+            prev = rows.get(k)
+            if prev is None:
+                rows[k] = [False, action, t]
+                continue
+            self.merged += 1
+            deleted, prev_action, prev_row = prev
+            if action == 'delete':
+                if prev_action == 'insert' and not deleted:
+                    rows.pop(k)  # 삽입후 삭제는 상쇄
+                else:
+                    rows[k] = [False, 'delete', t]
+            elif action == 'update':
+                if prev_action != 'delete':
+                    prev_row.update(t)
+            else:
+                # 삭제(또는 기존행) 후 재삽입
+                rows[k] = [deleted or prev_action != 'insert', 'insert', t]
+
+    def _drain(self, table):
+        pend = self._pending.pop(table)
+        fields = self.keys[table]
+        msgs = []
+        for symbol, snapshot in pend['partial'].items():
+            d = {'table': table, 'action': 'partial', 'keys': list(fields),
+                 'data': list(snapshot.values())}
+            if symbol is not None:
+                d['filter'] = {'symbol': symbol}
+            msgs.append(d)
+        batch = {'delete': [], 'insert': [], 'update': []}
+        for rows in pend['rows'].values():
+            for deleted, action, t in rows.values():
+                if deleted:
+                    batch['delete'].append({f: t[f] for f in fields})
+                batch[action].append(t)
+        for action in ('delete', 'insert', 'update'):
+            if batch[action]:
+                msgs.append({'table': table, 'action': action,
+                             'data': batch[action]})
+        return msgs
+
+    def get(self, timeout=None):
+        """
+        다음 메시지 (table, action, d), timeout 초과시 None
+        """
+        while not self._ready:
+            with self._cond:
+                if not self._cond.wait_for(
+                        lambda: self._q or self._dirty, timeout):
+                    return None
+                if self._dirty:
+                    table = self._dirty.popleft()
+                    for d in self._drain(table):
+                        self._ready.append((table, d['action'], d))
+                else:
+                    item = self._q.popleft()
+                    self._cond.notify_all()
+                    return item
+        return self._ready.popleft()
+
+    def dispatch(self, timeout=None):
+        """
+        메시지 하나를 꺼내 등록된 핸들러 호출, timeout 초과시 False
+        """
+        item = self.get(timeout)
+        if item is None:
+            return False
+        table, action, d = item
+        for handler in self.handlers.get(table, ()):
+            handler(table, action, d)
+        return True
+
+    def run_forever(self):
+        while True:
+            self.dispatch()
+
+    def qsize(self):
+        return len(self._q) + len(self._dirty) + len(self._ready)
+
+    def stats(self):
+        return {
+            'depth': self.qsize(),
+            'received': self.received,
+            'merged': self.merged,
+            'dropped': sum(self.dropped.values()),
+            'dropped_by_table': dict(self.dropped),
+        }
+
+
 class BitmexUtil:
     @classmethod
     def gen_signature(cls, secret, method, path, query_str, body_str, nonce):
@@ -218,6 +735,46 @@ class BitmexUtil:
         return signature
 
 
+    @classmethod
+    def auth_headers(cls, apikey, secret, method, path, query_str, body_str):
+        """
+        rest api 인증 헤더 (api-expires, api-key, api-signature)
+        """
+        expires = int(datetime.datetime.now().timestamp() * 1000)
+        sig = BitmexUtil.gen_signature(secret, method, path, query_str,
+                                       body_str, expires)
+        return {
+            'api-expires': str(expires),
+            'api-key': apikey,
+            'api-signature': sig,
+        }
+
+    @classmethod
+    def order_dict(cls, order_qty, price, symbol='XBTUSD', is_post_only=False):
+        """
+        지정가 주문 하나, 음수는 매도
+        """
+        order = {
+            'symbol': symbol,
+            'orderQty': order_qty,
+            'price': price,
+        }
+        if is_post_only: # 테이킹 주문 방지 (무조건 메이커)
+            order['execInst'] = 'ParticipateDoNotInitiate'
+        return order
+
+    @classmethod
+    def sniff_table(cls, message):
+        """
+        전체 파싱 없이 메시지 앞부분에서 (table, action) 을 읽는다, 없으면 (None, None)
+        """
+        if isinstance(message, bytes):
+            message = message[:128].decode('utf-8', 'ignore')
+        m = TABLE_PATTERN.match(message, 0, 128)
+        if m:
+            return m.group(1), m.group(2)
+        return None, None
+
     @classmethod
     def join_topics(cls, topics, symbol='XBTUSD'):
         return [itm + ':'+ symbol if itm != 'wallet' else itm for itm in topics]
@@ -234,6 +791,69 @@ class BitmexUtil:
         ]
         return BitmexUtil.join_topics(topics, symbol)
 
+    class WsRecentData:
+        """
+        웹소켓 수신 메시지를 테이블별 최신 상태로 보관
+        data[table] = {키 튜플: 행}, 키는 partial 메시지의 keys 필드
+        keys 가 없는 테이블(trade 등)은 수신 순번이 키 (최근 행만 남는 링처럼 동작)
+        테이블별 행 수는 max_rows(LIMITS 우선)까지, 넘치면 가장 오래 갱신 안된 행부터 지운다.
+        (주의점: 빗맥 문서대로 partial 전에 받은 테이블 메시지는 버린다.)
+        """
+        LIMITS = {'trade': 200, 'execution': 200, 'quote': 200}
+
+        def __init__(self, max_rows=1000, limits=None):
+            self.data = {}  # key: table, OrderedDict{키 튜플: 행}
+            self.keys = {}  # key: table, 키 필드
+            self.max_rows = max_rows
+            self.limits = dict(self.LIMITS, **(limits or {}))
+            self._seq = itertools.count()
+
+        def put_message(self, message):
+            """
+            원문(또는 디코딩된 dict) 반영, 반영한 테이블 이름을 반환
+            (테이블 메시지가 아니거나 partial 전이라 버린 경우는 None)
+            """
+            d = json_decode(message) if isinstance(message, (str, bytes)) else message
+            table = d.get('table')
+            if table is None or 'action' not in d:
+                return None
+            if not self.plexing(table, d['action'], d):
+                return None
+            return table
+
+        def plexing(self, table, action, d):
+            if 'partial' == action:
+                self.keys[table] = tuple(d.get('keys') or ())
+                self.data[table] = collections.OrderedDict()
+            rows = self.data.get(table)
+            if rows is None:  # partial 전
+                return False
+            keys = self.keys[table]
+            limit = self.limits.get(table, self.max_rows)
+            for t in d['data']:
+                key = tuple(t.get(k) for k in keys) if keys else next(self._seq)
+                if 'delete' == action:
+                    rows.pop(key, None)
+                    continue
+                row = rows.get(key)
+                if row is not None and 'update' == action:
+                    row.update(t)
+                    rows.move_to_end(key)
+                else:
+                    rows[key] = t
+                    if len(rows) > limit:
+                        rows.popitem(last=False)
+            return True
+
+        def get(self, table, *key):
+            """
+            키 값으로 행 조회 O(1), ex) get('position', 1, 'XBTUSD', 'XBt')
+            """
+            return self.data.get(table, {}).get(key)
+
+        def rows(self, table):
+            return self.data.get(table, {}).values()
+
     class WsBalance:
         """
         웹소켓 실시간수신 데이터로 구현되는 잔고
@@ -241,27 +861,51 @@ class BitmexUtil:
          account, currency 가 wallet, position 공통 키이지만 현재 두개는 고정값이므로
          향후 빗맥이 여러 코인을 지원하게 될 때 수정할 것, 현재는 Xbt(비트코인) 하나뿐이다.)
         """
-        def __init__(self):
+        POSITION_KEYS = ('realisedPnl', 'unrealisedPnl', 'maintMargin')
+
+        def __init__(self, on_change=None):
             self.wallet = {}    #  key: account, currency
             self.positions = {} #  key: account, currency, symbol
+            # 포지션 합계 (수신시 증감분만 반영, front_wallet 은 O(1))
+            self.sums = dict.fromkeys(self.POSITION_KEYS, 0)
+            # 증거금 관련 값이 바뀌었을때만 on_change(front_wallet()) 호출
+            self.on_change = on_change
 
         def plexing(self, table, action, d):
+            changed = False
             if 'wallet' == table:
                 d = d['data'][0]  # re - assign
+                amount = self.wallet.get('amount')
                 if 'partial' == action:
                     self.wallet = d
                 elif 'update' == action:
-                    for k in d.keys():
-                        self.wallet[k] = d[k]
+                    self.wallet.update(d)
+                changed = amount != self.wallet.get('amount')
 
             if 'position' == table:
+                sums = self.sums
                 if 'partial' == action:
                     for t in d['data']:
+                        old = self.positions.get(t['symbol'], {})
+                        for k in self.POSITION_KEYS:
+                            delta = (t.get(k) or 0) - (old.get(k) or 0)
+                            if delta:
+                                sums[k] += delta
+                                changed = True
                         self.positions[t['symbol']] = t
                 elif 'update' == action:
                     for t in d['data']:
-                        for k in t.keys():
-                            self.positions[t['symbol']][k] = t[k]
+                        pos = self.positions.setdefault(t['symbol'], {})
+                        for k in self.POSITION_KEYS:
+                            if k in t:
+                                delta = (t[k] or 0) - (pos.get(k) or 0)
+                                if delta:
+                                    sums[k] += delta
+                                    changed = True
+                        pos.update(t)
+
+            if changed and self.on_change is not None:
+                self.on_change(self.front_wallet())
 
         def front_wallet_keys(self):
             return [
@@ -280,14 +924,9 @@ class BitmexUtil:
             else:
                 amount = self.wallet['amount']
 
-            real_pnl = 0
-            unreal_pnl = 0
-            pos_margin = 0
-
-            for k in self.positions.keys():
-                real_pnl += self.positions[k]['realisedPnl']
-                unreal_pnl += self.positions[k]['unrealisedPnl']
-                pos_margin += self.positions[k]['maintMargin']
+            real_pnl = self.sums['realisedPnl']
+            unreal_pnl = self.sums['unrealisedPnl']
+            pos_margin = self.sums['maintMargin']
 
             available = amount + real_pnl + unreal_pnl - pos_margin
 
@@ -300,26 +939,185 @@ class BitmexUtil:
             }
 
 
+    class WsOrders:
+        """
+        웹소켓 order/execution 수신으로 유지되는 주문 상태 (REST 조회 대신)
+        주문은 orderID 로 갱신하고 symbol, side, ordStatus 인덱스도 같이 갱신한다.
+        open 은 심볼별 미체결 주문 (New, PartiallyFilled), 조회는 O(1)
+        종료된 주문은 max_closed 개, 체결내역(execType 이 Trade 인 execution)은
+        max_fills 개까지만 보관 (오래된 것부터 지운다.)
+        (주의점: partial 에 filter.symbol 이 있으면 그 심볼의 주문만 새로 받은 것으로 본다.)
+        """
+        OPEN_STATUS = ('New', 'PartiallyFilled')
+        INDEX_KEYS = ('symbol', 'side', 'ordStatus')
+
+        def __init__(self, max_closed=1000, max_fills=1000):
+            self.orders = {}  # key: orderID
+            # key: 인덱스키, 값, {orderID: 주문}
+            self.index = {k: {} for k in self.INDEX_KEYS}
+            self.open = {}  # key: symbol, {orderID: 주문}
+            self.closed = collections.OrderedDict()  # 종료된 순서의 orderID
+            self.max_closed = max_closed
+            self.fills = collections.deque(maxlen=max_fills)
+
+        def _add(self, row):
+            oid = row['orderID']
+            for k in self.INDEX_KEYS:
+                self.index[k].setdefault(row.get(k), {})[oid] = row
+            if row.get('ordStatus') in self.OPEN_STATUS:
+                self.open.setdefault(row.get('symbol'), {})[oid] = row
+            elif row.get('ordStatus') is not None:
+                self.closed[oid] = True
+                if len(self.closed) > self.max_closed:
+                    self._remove(self.closed.popitem(last=False)[0])
+
+        def _unindex(self, row):
+            oid = row['orderID']
+            for k in self.INDEX_KEYS:
+                bucket = self.index[k].get(row.get(k))
+                if bucket is not None:
+                    bucket.pop(oid, None)
+                    if not bucket:
+                        del self.index[k][row.get(k)]
+            opens = self.open.get(row.get('symbol'))
+            if opens is not None:
+                opens.pop(oid, None)
+            self.closed.pop(oid, None)
+
+        def _remove(self, oid):
+            row = self.orders.pop(oid, None)
+            if row is not None:
+                self._unindex(row)
+
+        def plexing(self, table, action, d):
+            if 'order' == table:
+                if 'partial' == action:
+                    symbol = (d.get('filter') or {}).get('symbol')
+                    if symbol is None:
+                        olds = list(self.orders)
+                    else:
+                        olds = list(self.index['symbol'].get(symbol, ()))
+                    for oid in olds:
+                        self._remove(oid)
+                if action in ('partial', 'insert'):
+                    for t in d['data']:
+                        self._remove(t['orderID'])
+                        self.orders[t['orderID']] = t
+                        self._add(t)
+                elif 'update' == action:
+                    for t in d['data']:
+                        row = self.orders.get(t['orderID'])
+                        if row is None:  # partial 전에 받은 주문
+                            row = self.orders[t['orderID']] = t
+                            self._add(t)
+                            continue
+                        reindex = any(k in t and t[k] != row.get(k)
+                                      for k in self.INDEX_KEYS)
+                        if reindex:
+                            self._unindex(row)
+                        row.update(t)
+                        if reindex:
+                            self._add(row)
+                elif 'delete' == action:
+                    for t in d['data']:
+                        self._remove(t['orderID'])
+
+            if 'execution' == table and action != 'delete':
+                for t in d['data']:
+                    if t.get('execType') == 'Trade':
+                        self.fills.append(t)
+
+        def get(self, order_id):
+            return self.orders.get(order_id)
+
+        def open_orders(self, symbol=None):
+            """
+            미체결 주문 {orderID: 주문}, symbol 없으면 전체 심볼
+            """
+            if symbol is not None:
+                return self.open.get(symbol, {})
+            ret = {}
+            for opens in self.open.values():
+                ret.update(opens)
+            return ret
+
+        def by(self, key, value):
+            """
+            인덱스 조회 {orderID: 주문}, ex) by('side', 'Buy'), by('ordStatus', 'Filled')
+            """
+            return self.index[key].get(value, {})
+
+        def recent_fills(self, limit=20, symbol=None):
+            """
+            최근 체결부터 limit 개
+            """
+            ret = []
+            for t in reversed(self.fills):
+                if symbol is None or t.get('symbol') == symbol:
+                    ret.append(t)
+                    if len(ret) >= limit:
+                        break
+            return ret
+
     class WsOrderBooks:
         """
         거래상품별 오더북 집합, 실시간수신 데이터를 넣으면 분류하여 오더북생성
+        book_class 로 오더북 엔진 선택 (기본: WsSortedOrderBook,
+        기존 엔진 비교시 BitmexUtil.WsOrderBook, 메모리 절약은 WsCompactOrderBook)
+        snapshot_depth > 0 이면 메시지를 적용할 때마다 심볼별 1차 ~ snapshot_depth차
+        호가를 불변 스냅샷(WsBookSnapshot)으로 발행, 다른 스레드는 snapshot() 으로
+        잠금없이 일관된 호가를 읽는다. (수신 스레드는 기다리지 않음)
         """
-        def __init__(self):
+        def __init__(self, book_class=None, snapshot_depth=0):
             self.books = {}
+            self.book_class = book_class or BitmexUtil.WsSortedOrderBook
+            self.snapshot_depth = snapshot_depth
+            self.snapshots = {}  # key: symbol, WsBookSnapshot (교체만 함)
 
         def plexing(self, table, action, d):
             if 'orderBookL2' == table:
+                # 심볼별로 묶은 뒤 오더북마다 한번에 적용
+                grouped = {}
                 for t in d['data']:
-                    symbol = t['symbol']
-                    if symbol not in self.books:
-                        self.books[symbol] = BitmexUtil.WsOrderBook(symbol)
-
-                    if action == 'delete':
-                        self.books[symbol].delete(t['id'], t['side'])
-                    elif action == 'update':
-                        self.books[symbol].update(t['id'], t['side'], t['size'])
+                    rows = grouped.get(t['symbol'])
+                    if rows is None:
+                        rows = grouped[t['symbol']] = []
+                    rows.append(t)
+
+                for symbol, rows in grouped.items():
+                    book = self.books.get(symbol)
+                    if book is None:
+                        book = self.books[symbol] = self.book_class(symbol)
+
+                    if action == 'partial':
+                        book.load_partial(rows)
                     else:
-                        self.books[symbol].insert(t['id'], t['side'], t['price'], t['size'])
+                        book.apply(action, rows)
+
+                    if self.snapshot_depth > 0:
+                        self._publish(symbol, book)
+
+        def _publish(self, symbol, book):
+            prev = self.snapshots.get(symbol)
+            depth = self.snapshot_depth
+            buys = tuple(zip(*book.top_levels('Buy', depth)))
+            slls = tuple(zip(*book.top_levels('Sell', depth)))
+            snap = BitmexUtil.WsBookSnapshot(
+                symbol, prev.version + 1 if prev else 1, time.time(), buys,
+                slls)
+            if prev is None:
+                # 새 심볼은 dict 를 복사해서 교체 (읽는 쪽 순회중 변경 방지)
+                snapshots = dict(self.snapshots)
+                snapshots[symbol] = snap
+                self.snapshots = snapshots
+            else:
+                self.snapshots[symbol] = snap
+
+        def snapshot(self, symbol):
+            """
+            지정한 심볼의 최신 스냅샷, 없으면 None (어느 스레드에서나 호출 가능)
+            """
+            return self.snapshots.get(symbol)
 
         def gen_buys(self, symbol, limit=20):
             """
@@ -343,6 +1141,48 @@ class BitmexUtil:
                 accum += qty
                 yield pr, qty, accum
 
+        def depth_view(self, symbol, side='Buy', limit=20):
+            """
+            지정한 심볼의 1차 ~ limit차 호가를 배열로 (itg_bitmexdepth.WsDepthView)
+            numpy 는 이 기능을 쓸 때만 import
+            """
+            from itgaecoin.itg_bitmexdepth import depth_view
+            return depth_view(self, symbol, side, limit)
+
+        def liquidity_within(self, symbol, bps, limit=500):
+            """
+            중간가격 기준 ±bps 안에 있는 매수, 매도 누적수량
+            bps 가 리스트면 (매수배열, 매도배열) (itg_bitmexdepth.liquidity_within)
+            """
+            from itgaecoin.itg_bitmexdepth import liquidity_within
+            return liquidity_within(self, symbol, bps, limit)
+
+    class WsBookSnapshot(collections.namedtuple(
+            'WsBookSnapshot', 'symbol version ts buys slls')):
+        """
+        WsOrderBooks 가 발행하는 불변 호가 스냅샷
+        buys, slls: ((가격, 수량), ...) 1차호가부터, version: 발행순번, ts: 발행시각
+        """
+        __slots__ = ()
+
+        def gen_buys(self, limit=20):
+            """
+            1차 ~ limit차 매수호가 제네레이터 (가격,수량,누적)
+            """
+            accum = 0
+            for pr, qty in self.buys[:limit]:
+                accum += qty
+                yield pr, qty, accum
+
+        def gen_slls(self, limit=20):
+            """
+            1차 ~ limit차 매도호가 제네레이터 (가격,수량,누적)
+            """
+            accum = 0
+            for pr, qty in self.slls[:limit]:
+                accum += qty
+                yield pr, qty, accum
+
     class WsOrderBook:
         """
         오더북 구현, 기본적으로 id 별로 주문을 구분하되, 가격순 정렬을 유지하여
@@ -416,6 +1256,56 @@ class BitmexUtil:
                         self.sll_id = self.sll_id[0:idx] + self.sll_id[idx + 1:lens]
                         self.sll_orders.pop(iid, None)
 
+        def load_partial(self, rows):
+            """
+            partial 스냅샷으로 오더북을 새로 구성 (측면별 정렬 1회)
+            """
+            buys = sorted((t for t in rows if t['side'] == 'Buy'),
+                          key=lambda t: t['price'])
+            slls = sorted((t for t in rows if t['side'] != 'Buy'),
+                          key=lambda t: t['price'])
+            self.buy_pr = [t['price'] for t in buys]
+            self.buy_id = [t['id'] for t in buys]
+            self.sll_pr = [t['price'] for t in slls]
+            self.sll_id = [t['id'] for t in slls]
+            self.buy_orders = {t['id']: {'price': t['price'], 'size': t['size']}
+                               for t in buys}
+            self.sll_orders = {t['id']: {'price': t['price'], 'size': t['size']}
+                               for t in slls}
+
+        def apply(self, action, rows):
+            """
+            insert/update/delete 묶음을 한번에 적용
+            """
+            if action == 'delete':
+                delete = self.delete
+                for t in rows:
+                    delete(t['id'], t['side'])
+            elif action == 'update':
+                update = self.update
+                for t in rows:
+                    update(t['id'], t['side'], t['size'])
+            else:
+                insert = self.insert
+                for t in rows:
+                    insert(t['id'], t['side'], t['price'], t['size'])
+
+        def top_levels(self, side, limit=20):
+            """
+            1차 ~ limit차 호가를 (가격리스트, 수량리스트)로 (슬라이싱)
+            """
+            if limit <= 0:
+                return [], []
+            if side == 'Buy':
+                prs = self.buy_pr[-limit:][::-1]
+                ids = self.buy_id[-limit:][::-1]
+                orders = self.buy_orders
+            else:
+                prs = self.sll_pr[:limit]
+                ids = self.sll_id[:limit]
+                orders = self.sll_orders
+            return prs, [orders[iid]['size'] for iid in ids]
+
         def gen_buys(self, limit=20):
             lens = len(self.buy_pr)
             for i, pr in enumerate(reversed(self.buy_pr)):
@@ -431,6 +1321,216 @@ class BitmexUtil:
                 else:
                     break
 
+    class WsSortedOrderBook:
+        """
+        정렬컨테이너(SortedDict) 기반 오더북, WsOrderBook 과 같은 API
+        리스트를 복사하지 않고 제자리 갱신 (insert/delete O(logN), update O(1))
+        가격별 값은 *_orders 와 같은 주문 dict 를 공유하여 조회시 한번만 찾는다.
+        (주의점: 가격당 id 하나를 전제함, 수신데이터 정합성 체크하지 않음)
+        """
+        def __init__(self, symbol='XBTUSD'):
+            self.symbol = symbol
+            self.buy_pr = SortedDict()  # key: price, {'price':float, 'size':int} (sorted)
+            self.sll_pr = SortedDict()  # key: price, {'price':float, 'size':int} (sorted)
+            self.buy_orders = {}  # key: iid, {'price':float, 'size':int}
+            self.sll_orders = {}  # key: iid, {'price':float, 'size':int}
+
+        def _side(self, side):
+            if side == 'Buy':
+                return self.buy_pr, self.buy_orders
+            return self.sll_pr, self.sll_orders
+
+        def insert(self, iid, side, price, size):
+            prs, orders = self._side(side)
+            if price in prs:  # already exist
+                print('already exist')
+                return
+            order = {'price': price, 'size': size}
+            prs[price] = order  # O(logN)
+            orders[iid] = order
+
+        def update(self, iid, side, size):
+            prs, orders = self._side(side)
+            if iid in orders:
+                orders[iid]['size'] = size
+
+        def delete(self, iid, side):
+            prs, orders = self._side(side)
+            order = orders.pop(iid, None)
+            if order is None:
+                return
+            prs.pop(order['price'], None)  # O(logN)
+
+        def load_partial(self, rows):
+            """
+            partial 스냅샷으로 오더북을 새로 구성 (측면별 정렬 1회)
+            """
+            buy_pr = {}
+            sll_pr = {}
+            self.buy_orders = {}
+            self.sll_orders = {}
+            for t in rows:
+                order = {'price': t['price'], 'size': t['size']}
+                if t['side'] == 'Buy':
+                    buy_pr[t['price']] = order
+                    self.buy_orders[t['id']] = order
+                else:
+                    sll_pr[t['price']] = order
+                    self.sll_orders[t['id']] = order
+            self.buy_pr = SortedDict(buy_pr)
+            self.sll_pr = SortedDict(sll_pr)
+
+        def apply(self, action, rows):
+            """
+            insert/update/delete 묶음을 한번에 적용
+            """
+            if action == 'delete':
+                delete = self.delete
+                for t in rows:
+                    delete(t['id'], t['side'])
+            elif action == 'update':
+                buy_orders = self.buy_orders
+                sll_orders = self.sll_orders
+                for t in rows:
+                    orders = buy_orders if t['side'] == 'Buy' else sll_orders
+                    order = orders.get(t['id'])
+                    if order is not None:
+                        order['size'] = t['size']
+            else:
+                insert = self.insert
+                for t in rows:
+                    insert(t['id'], t['side'], t['price'], t['size'])
+
+        def top_levels(self, side, limit=20):
+            """
+            1차 ~ limit차 호가를 (가격리스트, 수량리스트)로 (슬라이싱)
+            """
+            if limit <= 0:
+                return [], []
+            prs, orders = self._side(side)
+            if side == 'Buy':
+                keys = prs.keys()[-limit:][::-1]
+            else:
+                keys = prs.keys()[:limit]
+            return keys, [prs[pr]['size'] for pr in keys]
+
+        def gen_buys(self, limit=20):
+            prs, sizes = self.top_levels('Buy', limit)
+            return zip(prs, sizes)
+
+        def gen_slls(self, limit=20):
+            prs, sizes = self.top_levels('Sell', limit)
+            return zip(prs, sizes)
+
+    class WsCompactOrderBook:
+        """
+        배열(array) 기반 메모리 절약형 오더북, WsOrderBook 과 같은 API
+        측면별로 가격순 정렬된 가격(double), -id(int64), 수량(int64) 배열 세개만 둔다.
+        호가당 24바이트 (dict 기반 엔진은 호가당 수백바이트)
+        빗맥 L2 의 id 는 (100000000 * 심볼번호) - (가격 / 틱크기) 이므로 가격이 오르면
+        id 는 내려간다. 따라서 -id 도 가격순으로 정렬되어 id 로도 이진탐색 가능
+        (주의점: 위의 id 규칙을 전제함, 삽입/삭제는 배열 내부 memmove)
+        """
+        def __init__(self, symbol='XBTUSD'):
+            self.symbol = symbol
+            self.buy_pr = array('d')  # sorted
+            self.buy_nid = array('q')  # -iid, sorted
+            self.buy_sz = array('q')
+            self.sll_pr = array('d')  # sorted
+            self.sll_nid = array('q')  # -iid, sorted
+            self.sll_sz = array('q')
+
+        def _side(self, side):
+            if side == 'Buy':
+                return self.buy_pr, self.buy_nid, self.buy_sz
+            return self.sll_pr, self.sll_nid, self.sll_sz
+
+        @staticmethod
+        def _find(nids, iid):
+            idx = bisect.bisect_left(nids, -iid)  # O(logN)
+            if idx < len(nids) and nids[idx] == -iid:
+                return idx
+            return -1
+
+        def insert(self, iid, side, price, size):
+            prs, nids, szs = self._side(side)
+            idx = bisect.bisect_left(prs, price)
+            if idx < len(prs) and prs[idx] == price:  # already exist
+                print('already exist')
+                return
+            prs.insert(idx, price)
+            nids.insert(idx, -iid)
+            szs.insert(idx, size)
+
+        def update(self, iid, side, size):
+            prs, nids, szs = self._side(side)
+            idx = self._find(nids, iid)
+            if idx >= 0:
+                szs[idx] = size
+
+        def delete(self, iid, side):
+            prs, nids, szs = self._side(side)
+            idx = self._find(nids, iid)
+            if idx >= 0:
+                del prs[idx]
+                del nids[idx]
+                del szs[idx]
+
+        def load_partial(self, rows):
+            """
+            partial 스냅샷으로 오더북을 새로 구성 (측면별 정렬 1회)
+            """
+            buys = sorted((t for t in rows if t['side'] == 'Buy'),
+                          key=lambda t: t['price'])
+            slls = sorted((t for t in rows if t['side'] != 'Buy'),
+                          key=lambda t: t['price'])
+            self.buy_pr = array('d', [t['price'] for t in buys])
+            self.buy_nid = array('q', [-t['id'] for t in buys])
+            self.buy_sz = array('q', [t['size'] for t in buys])
+            self.sll_pr = array('d', [t['price'] for t in slls])
+            self.sll_nid = array('q', [-t['id'] for t in slls])
+            self.sll_sz = array('q', [t['size'] for t in slls])
+
+        def apply(self, action, rows):
+            """
+            insert/update/delete 묶음을 한번에 적용
+            """
+            if action == 'delete':
+                delete = self.delete
+                for t in rows:
+                    delete(t['id'], t['side'])
+            elif action == 'update':
+                update = self.update
+                for t in rows:
+                    update(t['id'], t['side'], t['size'])
+            else:
+                insert = self.insert
+                for t in rows:
+                    insert(t['id'], t['side'], t['price'], t['size'])
+
+        def top_levels(self, side, limit=20):
+            """
+            1차 ~ limit차 호가를 (가격리스트, 수량리스트)로 (슬라이싱)
+            """
+            if limit <= 0:
+                return [], []
+            prs, nids, szs = self._side(side)
+            if side == 'Buy':
+                prs = prs[-limit:].tolist()
+                szs = szs[-limit:].tolist()
+                prs.reverse()
+                szs.reverse()
+                return prs, szs
+            return prs[:limit].tolist(), szs[:limit].tolist()
+
+        def gen_buys(self, limit=20):
+            prs, sizes = self.top_levels('Buy', limit)
+            return zip(prs, sizes)
+
+        def gen_slls(self, limit=20):
+            prs, sizes = self.top_levels('Sell', limit)
+            return zip(prs, sizes)
+
 
 
 if __name__ == "__main__":
@@ -441,12 +1541,17 @@ if __name__ == "__main__":
 
     #bapi.post_order(10000, 8630)
 
-    wapi = BitmexWebsocket(apikey, secret)
-    msg_q = wapi.get_message_queue()
+    books = BitmexUtil.WsOrderBooks()
+    dispatcher = BitmexDispatcher()
+    dispatcher.register('orderBookL2', books.plexing)
+    for table in ['position', 'order', 'execution', 'wallet']:
+        dispatcher.register(table, lambda t, a, d: print(d))
+
+    wapi = BitmexWebsocket(apikey, secret, dispatcher,
+                           tables=dispatcher.handlers.keys(), decode=True)
     wapi.run_with_topics(
         ['position', 'order', 'execution', 'wallet', 'orderBookL2'])
 
     while True:
-        itm = msg_q.get()  # blocking
-        a = json.loads(itm)
-        print(a)
+        dispatcher.dispatch()  # blocking
+        print(list(books.gen_buys('XBTUSD', 1)), dispatcher.stats())
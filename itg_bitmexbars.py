@@ -0,0 +1,159 @@
+# coding: utf-8
+"""
+웹소켓 trade 로 만드는 OHLCV 봉 (numpy 링버퍼)
+itg_bitmexapi 가 numpy 없이도 쓰일 수 있도록 따로 둔다.
+ex) bars = WsTradeBars(); dispatcher.register('trade', bars.plexing)
+"""
+import datetime
+import time
+
+import numpy as np  # 3rd party lib(https://pypi.python.org/pypi/numpy)
+
+
+class WsTradeBars:
+    """
+    웹소켓 trade 수신으로 타임프레임별(초) OHLCV, VWAP, 체결수 봉을 점진적으로 만든다.
+    심볼, 타임프레임마다 WsBarSeries(미리 할당한 numpy 링버퍼) 하나
+    체결이 없던 구간의 봉은 만들지 않는다. (봉마다 ts 로 구분)
+    on_close(symbol, tf, series) 는 봉이 닫힐때 호출
+    ex) bars.bars('XBTUSD', 60, 20)[WsBarSeries.CLOSE]  # 최근 20개 1분봉 종가
+    """
+    TIMEFRAMES = (1, 60, 300, 3600)
+
+    def __init__(self, timeframes=TIMEFRAMES, capacity=1000, on_close=None):
+        self.timeframes = timeframes
+        self.capacity = capacity
+        self.on_close = on_close
+        self.series = {}  # key: symbol, [WsBarSeries] (timeframes 순서)
+        self._minutes = {}  # key: 'YYYY-MM-DDTHH:MM', epoch 초
+
+    def parse_ts(self, timestamp):
+        """
+        '2018-03-01T12:34:56.789Z' -> epoch 초, 분 단위까지는 캐시
+        """
+        minute = timestamp[:16]
+        base = self._minutes.get(minute)
+        if base is None:
+            if len(self._minutes) > 1000:
+                self._minutes.clear()
+            base = self._minutes[minute] = datetime.datetime.strptime(
+                minute, '%Y-%m-%dT%H:%M').replace(
+                tzinfo=datetime.timezone.utc).timestamp()
+        return base + float(timestamp[17:].rstrip('Z'))
+
+    def plexing(self, table, action, d):
+        if 'trade' == table and action in ('partial', 'insert'):
+            for t in d['data']:
+                self.add(t['symbol'], self.parse_ts(t['timestamp']),
+                         t['price'], t['size'])
+
+    def add(self, symbol, ts, price, size):
+        series = self.series.get(symbol)
+        if series is None:
+            series = self.series[symbol] = [
+                WsBarSeries(tf, self.capacity)
+                for tf in self.timeframes]
+        for ser in series:
+            if ser.add(ts, price, size) and self.on_close is not None:
+                self.on_close(symbol, ser.tf, ser)
+
+    def roll(self, now=None):
+        """
+        now 기준으로 기간이 끝난 진행중 봉을 닫는다. (거래가 뜸할때 주기적으로 호출)
+        """
+        now = time.time() if now is None else now
+        for symbol, series in self.series.items():
+            for ser in series:
+                if ser.roll(now) and self.on_close is not None:
+                    self.on_close(symbol, ser.tf, ser)
+
+    def get(self, symbol, tf):
+        return self.series[symbol][self.timeframes.index(tf)]
+
+    def bars(self, symbol, tf, n=100):
+        """
+        닫힌 봉 최근 n개 (FIELDS, n) 뷰 (복사하지 않음)
+        """
+        return self.get(symbol, tf).latest(n)
+
+    def current(self, symbol, tf):
+        return self.get(symbol, tf).current()
+
+
+class WsBarSeries:
+    """
+    타임프레임 하나의 봉 링버퍼, 진행중 봉은 파이썬 값으로 갱신하고 닫힐때만 버퍼에 쓴다.
+    버퍼를 2배로 잡고 같은 봉을 idx, idx + capacity 두곳에 써서
+    최근 n개가 항상 연속된 구간이 되도록 한다. (latest 는 복사없는 뷰, O(1))
+    (주의점: 뷰는 이후 봉이 닫히면 덮어써지므로 보관하려면 복사할 것)
+    """
+    FIELDS = ('ts', 'open', 'high', 'low', 'close', 'volume', 'vwap', 'count')
+    TS, OPEN, HIGH, LOW, CLOSE, VOLUME, VWAP, COUNT = range(8)
+
+    def __init__(self, tf, capacity=1000):
+        self.tf = tf
+        self.capacity = capacity
+        self.buf = np.zeros((len(self.FIELDS), capacity * 2), dtype=np.float64)
+        self.closed = 0  # 닫힌 봉 수
+        self.cur = None  # [ts, open, high, low, close, volume, 거래대금, count]
+
+    def add(self, ts, price, size):
+        """
+        체결 하나 반영, 직전 봉이 닫혔으면 True
+        """
+        start = ts - ts % self.tf
+        cur = self.cur
+        if cur is not None and start <= cur[0]:  # 같은 봉 (늦게 온 체결 포함)
+            if price > cur[2]:
+                cur[2] = price
+            elif price < cur[3]:
+                cur[3] = price
+            cur[4] = price
+            cur[5] += size
+            cur[6] += price * size
+            cur[7] += 1
+            return False
+        ret = False
+        if cur is not None:
+            self._close()
+            ret = True
+        self.cur = [start, price, price, price, price, size, price * size, 1]
+        return ret
+
+    def roll(self, now):
+        if self.cur is not None and now >= self.cur[0] + self.tf:
+            self._close()
+            self.cur = None
+            return True
+        return False
+
+    def _close(self):
+        cur = self.cur
+        row = cur[:6]
+        row.append(cur[6] / cur[5] if cur[5] else cur[4])  # vwap
+        row.append(cur[7])
+        idx = self.closed % self.capacity
+        self.buf[:, idx] = row
+        self.buf[:, idx + self.capacity] = row
+        self.closed += 1
+
+    def latest(self, n=100):
+        """
+        닫힌 봉 최근 n개 (FIELDS, n) 뷰, 오래된 봉부터
+        """
+        n = min(n, self.closed, self.capacity)
+        end = (self.closed - 1) % self.capacity + self.capacity + 1
+        return self.buf[:, end - n:end]
+
+    def field(self, name, n=100):
+        return self.latest(n)[self.FIELDS.index(name)]
+
+    def current(self):
+        """
+        진행중 봉 (FIELDS 순서 튜플) 또는 None
+        """
+        cur = self.cur
+        if cur is None:
+            return None
+        return (cur[0], cur[1], cur[2], cur[3], cur[4], cur[5],
+                cur[6] / cur[5] if cur[5] else cur[4], cur[7])
@@ -0,0 +1,104 @@
+# coding: utf-8
+"""
+WsOrderBooks 호가의 numpy 배열 뷰 (충격가격, VWAP, 범위내 유동성)
+itg_bitmexapi 가 numpy 없이도 쓰일 수 있도록 따로 둔다.
+ex) view = books.depth_view('XBTUSD', 'Buy', 50)  # 또는 depth_view(books, ...)
+    view.impact_prices([1000, 10000, 100000])
+"""
+import numpy as np  # 3rd party lib(https://pypi.python.org/pypi/numpy)
+
+
+def depth_view(books, symbol, side='Buy', limit=20):
+    """
+    WsOrderBooks 에서 지정한 심볼의 1차 ~ limit차 호가를 WsDepthView 로
+    """
+    if symbol not in books.books:
+        return WsDepthView(side, [], [])
+    prs, qtys = books.books[symbol].top_levels(side, limit)
+    return WsDepthView(side, prs, qtys)
+
+
+def liquidity_within(books, symbol, bps, limit=500):
+    """
+    중간가격 기준 ±bps 안에 있는 매수, 매도 누적수량
+    bps 가 리스트면 (매수배열, 매도배열)
+    limit 은 처음 가져올 호가 수, 범위가 그보다 깊으면 늘려서 다시 가져온다.
+    """
+    buys = depth_view(books, symbol, 'Buy', limit)
+    slls = depth_view(books, symbol, 'Sell', limit)
+    bps = np.asarray(bps, dtype=np.float64)
+    if len(buys.prices) == 0 or len(slls.prices) == 0:
+        nan = np.full(bps.shape, np.nan)[()]
+        return nan, nan
+    mid = (buys.prices[0] + slls.prices[0]) / 2
+    widest = bps.max() / 10000 if bps.size else 0.0
+    n = limit
+    while len(buys.prices) == n and buys.prices[-1] >= mid * (1 - widest):
+        n *= 4
+        buys = depth_view(books, symbol, 'Buy', n)
+    n = limit
+    while len(slls.prices) == n and slls.prices[-1] <= mid * (1 + widest):
+        n *= 4
+        slls = depth_view(books, symbol, 'Sell', n)
+    return (buys.qty_within(mid * (1 - bps / 10000)),
+            slls.qty_within(mid * (1 + bps / 10000)))
+
+
+class WsDepthView:
+    """
+    한쪽 호가의 배열 뷰 (가격, 수량, 누적수량, 누적금액), 1차호가부터 정렬
+    배열 인자를 받는 조회는 벡터연산으로 한번에 계산
+    """
+    def __init__(self, side, prices, sizes):
+        self.side = side
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.sizes = np.asarray(sizes, dtype=np.float64)
+        self.accum = np.cumsum(self.sizes)
+        self.notional = np.cumsum(self.prices * self.sizes)
+
+    def impact_prices(self, qtys):
+        """
+        qtys 수량을 시장가로 채울때 평균체결가 (호가 깊이 부족시 nan)
+        """
+        qtys = np.asarray(qtys, dtype=np.float64)
+        lens = len(self.accum)
+        if lens == 0:
+            return np.full(qtys.shape, np.nan)[()]
+        idx = np.searchsorted(self.accum, qtys, side='left')
+        ok = (idx < lens) & (qtys > 0)
+        idx = np.minimum(idx, lens - 1)
+        prev_qty = np.where(idx > 0, self.accum[idx - 1], 0.0)
+        prev_ntl = np.where(idx > 0, self.notional[idx - 1], 0.0)
+        ntl = prev_ntl + (qtys - prev_qty) * self.prices[idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(ok, ntl / qtys, np.nan)[()]
+
+    def vwap(self, depth):
+        """
+        1차 ~ depth차 호가의 거래량가중평균가격 (depth 리스트 가능)
+        호가가 depth 단계보다 적으면 impact_prices 와 같이 nan
+        """
+        depth = np.asarray(depth)
+        lens = len(self.accum)
+        if lens == 0:
+            return np.full(depth.shape, np.nan)[()]
+        idx = np.clip(depth - 1, 0, lens - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where((depth > 0) & (depth <= lens),
+                            self.notional[idx] / self.accum[idx],
+                            np.nan)[()]
+
+    def qty_within(self, bound):
+        """
+        bound 가격까지(포함) 누적수량, 매수는 bound 이상, 매도는 bound 이하
+        (뷰에 들어있는 호가까지만 센다, 더 깊으면 liquidity_within)
+        """
+        bound = np.asarray(bound, dtype=np.float64)
+        if self.side == 'Buy':  # 내림차순
+            cnt = np.searchsorted(-self.prices, -bound, side='right')
+        else:
+            cnt = np.searchsorted(self.prices, bound, side='right')
+        if len(self.accum) == 0:
+            return np.zeros(bound.shape)[()]
+        return np.where(cnt > 0, self.accum[np.maximum(cnt - 1, 0)],
+                        0.0)[()]
@@ -0,0 +1,367 @@
+# coding: utf-8
+"""
+부하시험용 로컬 빗맥 대역 서버 (실제 거래소에 접속하지 않는다)
+/realtime 웹소켓 (authKey, subscribe 후 orderBookL2/trade/position 스트림 생성)과
+_req 가 호출하는 rest api (/order, /order/bulk, /position, /position/leverage,
+/user/wallet) 를 x-ratelimit 헤더와 지연시간을 흉내내어 제공한다.
+
+ex) python -m itgaecoin.itg_bitmexfake --port 8080 --rate 10000 --latency 0.002
+    BitmexAPI(apikey, secret, base_url='http://127.0.0.1:8080')
+    BitmexWebsocket(apikey, secret, base_url='ws://127.0.0.1:8080/realtime')
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web  # 3rd party lib(https://pypi.python.org/pypi/aiohttp)
+
+from itgaecoin.itg_bitmexapi import BitmexUtil
+
+
+def iso_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(
+        timespec='milliseconds')[:23] + 'Z'
+
+
+class FakeMarket:
+    """
+    웹소켓 연결마다 하나씩 만드는 가상 시장, 중간가격이 랜덤워크하며
+    오더북 델타, 체결, 포지션 메시지를 만든다.
+    매수 호가는 mid-levels ~ mid-1, 매도 호가는 mid+1 ~ mid+levels (틱 단위)
+    """
+    def __init__(self, symbols=('XBTUSD',), levels=500, tick_size=0.5,
+                 seed=None):
+        self.rnd = random.Random(seed)
+        self.symbols = list(symbols)
+        self.levels = levels
+        self.tick_size = tick_size
+        self.mids = {s: 12000 for s in self.symbols}  # 틱 단위
+        self.sizes = {}  # key: (symbol, tick), size
+
+        for symbol in self.symbols:
+            mid = self.mids[symbol]
+            for i in range(1, levels + 1):
+                self.sizes[(symbol, mid - i)] = self.rnd.randint(1, 50000)
+                self.sizes[(symbol, mid + i)] = self.rnd.randint(1, 50000)
+
+    def _row(self, symbol, tick, with_size=True, with_price=False):
+        s_idx = self.symbols.index(symbol)
+        row = {
+            'symbol': symbol,
+            'id': 100000000 * s_idx + (100000000 - tick),
+            'side': 'Buy' if tick < self.mids[symbol] else 'Sell',
+        }
+        if with_size:
+            row['size'] = self.sizes[(symbol, tick)]
+        if with_price:
+            row['price'] = tick * self.tick_size
+        return row
+
+    def partial(self, table):
+        if table == 'orderBookL2':
+            data = [self._row(s, t, True, True) for s, t in
+                    sorted(self.sizes.keys())]
+            return {'table': table, 'action': 'partial',
+                    'keys': ['symbol', 'id', 'side'], 'data': data}
+        if table == 'position':
+            return {'table': table, 'action': 'partial',
+                    'keys': ['account', 'symbol', 'currency'],
+                    'data': [self.position(s) for s in self.symbols]}
+        return {'table': table, 'action': 'partial', 'data': []}
+
+    def position(self, symbol):
+        return {
+            'account': 1, 'symbol': symbol, 'currency': 'XBt',
+            'leverage': 10, 'currentQty': 0,
+            'markPrice': self.mids[symbol] * self.tick_size,
+            'realisedPnl': 0,
+            'unrealisedPnl': self.rnd.randint(-100000, 100000),
+            'maintMargin': self.rnd.randint(0, 100000),
+            'timestamp': iso_now(),
+        }
+
+    def next_messages(self, tables):
+        """
+        다음 메시지 dict 들, tables 에 구독한 테이블만
+        """
+        rnd = self.rnd
+        symbol = rnd.choice(self.symbols)
+        mid = self.mids[symbol]
+        r = rnd.random()
+        msgs = []
+        if r < 0.01 and 'position' in tables:
+            msgs.append({'table': 'position', 'action': 'update',
+                         'data': [self.position(symbol)]})
+        elif r < 0.15:
+            # 가격 이동: 한쪽 1호가가 사라지고 반대편에 생긴다.
+            up = rnd.random() < 0.5
+            step = 1 if up else -1
+            gone = mid + step                   # 사라지는 1호가
+            far = mid - step * self.levels      # 사라지는 가장 먼 호가
+            new_far = mid + step * (self.levels + 1)
+            if 'orderBookL2' in tables:
+                msgs.append({'table': 'orderBookL2', 'action': 'delete',
+                             'data': [self._row(symbol, gone, False),
+                                      self._row(symbol, far, False)]})
+            if 'trade' in tables:
+                msgs.append({'table': 'trade', 'action': 'insert', 'data': [{
+                    'timestamp': iso_now(), 'symbol': symbol,
+                    'side': 'Buy' if up else 'Sell',
+                    'size': self.sizes[(symbol, gone)],
+                    'price': gone * self.tick_size,
+                    'tickDirection': 'PlusTick' if up else 'MinusTick',
+                }]})
+            del self.sizes[(symbol, gone)]
+            del self.sizes[(symbol, far)]
+            self.mids[symbol] = mid + step
+            self.sizes[(symbol, mid)] = rnd.randint(1, 50000)
+            self.sizes[(symbol, new_far)] = rnd.randint(1, 50000)
+            if 'orderBookL2' in tables:
+                msgs.append({'table': 'orderBookL2', 'action': 'insert',
+                             'data': [self._row(symbol, mid, True, True),
+                                      self._row(symbol, new_far, True, True)]})
+        elif 'orderBookL2' in tables:
+            rows = []
+            for _ in range(rnd.randint(1, 4)):
+                tick = mid + rnd.choice((-1, 1)) * rnd.randint(1, min(
+                    self.levels, 25))
+                self.sizes[(symbol, tick)] = rnd.randint(1, 50000)
+                rows.append(self._row(symbol, tick))
+            msgs.append({'table': 'orderBookL2', 'action': 'update',
+                         'data': rows})
+        return msgs
+
+
+class BitmexFakeServer:
+    """
+    빗맥 대역 서버
+    rate: 웹소켓 연결당 초당 메시지 수, latency/jitter: rest 응답 지연(초)
+    limit: 분당 요청 제한 (x-ratelimit-*, 초과시 429)
+    secret 을 지정하면 서명을 검사한다. order_log 에 (수신시각, 주문) 기록
+    """
+    def __init__(self, host='127.0.0.1', port=8080, rate=1000, latency=0.0,
+                 jitter=0.0, limit=60, levels=500, symbols=('XBTUSD',),
+                 secret=None):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.latency = latency
+        self.jitter = jitter
+        self.limit = limit
+        self.levels = levels
+        self.symbols = list(symbols)
+        self.secret = secret
+        self.orders = {}     # key: orderID
+        self.order_log = []  # (수신시각, 주문)
+        self.sent = 0        # 웹소켓으로 보낸 메시지 수
+        self.buckets = {}    # key: api-key, [남은 요청수, 갱신시각]
+        self.leverage = {s: 10 for s in self.symbols}
+        self.runner = None
+
+        self.app = web.Application()
+        pre = '/api/v1'
+        self.app.router.add_get('/realtime', self.realtime)
+        self.app.router.add_post(pre + '/order', self.post_order)
+        self.app.router.add_delete(pre + '/order', self.delete_order)
+        self.app.router.add_post(pre + '/order/bulk', self.post_order_bulk)
+        self.app.router.add_put(pre + '/order/bulk', self.put_order_bulk)
+        self.app.router.add_get(pre + '/position', self.get_position)
+        self.app.router.add_post(pre + '/position/leverage',
+                                 self.post_position_leverage)
+        self.app.router.add_get(pre + '/user/wallet', self.get_user_wallet)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def run_forever(self):
+        async def serve():
+            await self.start()
+            while True:
+                await asyncio.sleep(3600)
+        asyncio.run(serve())
+
+    # websocket
+
+    async def realtime(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        market = FakeMarket(self.symbols, self.levels)
+        tables = set()
+        streamer = None
+        try:
+            async for msg in ws:
+                if msg.type != web.WSMsgType.TEXT:
+                    continue
+                req = json.loads(msg.data)
+                if req.get('op') == 'authKey':
+                    await ws.send_str(json.dumps({'success': True,
+                                                  'request': req}))
+                elif req.get('op') == 'subscribe':
+                    for topic in req.get('args', []):
+                        table = topic.split(':')[0]
+                        tables.add(table)
+                        await ws.send_str(json.dumps({
+                            'success': True, 'subscribe': topic,
+                            'request': req}))
+                        await ws.send_str(json.dumps(market.partial(table)))
+                    if streamer is None:
+                        streamer = asyncio.ensure_future(
+                            self._stream(ws, market, tables))
+        finally:
+            if streamer is not None:
+                streamer.cancel()
+        return ws
+
+    async def _stream(self, ws, market, tables):
+        start = time.time()
+        sent = 0
+        while not ws.closed:
+            due = int((time.time() - start) * self.rate) - sent
+            for _ in range(min(due, 10000)):
+                for d in market.next_messages(tables):
+                    await ws.send_str(json.dumps(d))
+                    self.sent += 1
+                sent += 1
+            await asyncio.sleep(0.001)
+
+    # rest
+
+    async def _begin(self, request):
+        """
+        지연, 서명검사, 요청제한 처리, 응답 헤더와 본문 dict 를 반환
+        """
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        body_str = await request.text()
+        key = request.headers.get('api-key', '')
+        if self.secret is not None:
+            sig = BitmexUtil.gen_signature(
+                self.secret, request.method, request.path_qs,
+                '', body_str, request.headers.get('api-expires', ''))
+            if sig != request.headers.get('api-signature'):
+                raise web.HTTPUnauthorized(
+                    text=json.dumps({'error': {'message': 'Signature not valid.'}}),
+                    content_type='application/json')
+
+        # 토큰버킷, 분당 limit 개
+        now = time.time()
+        remain, last = self.buckets.get(key, (self.limit, now))
+        remain = min(self.limit, remain + (now - last) * self.limit / 60)
+        headers = {'x-ratelimit-limit': str(self.limit)}
+        if remain < 1:
+            self.buckets[key] = (remain, now)
+            headers['x-ratelimit-remaining'] = '0'
+            headers['x-ratelimit-reset'] = str(int(now + 60))
+            headers['retry-after'] = str(int((1 - remain) * 60 / self.limit) + 1)
+            raise web.HTTPTooManyRequests(
+                headers=headers,
+                text=json.dumps({'error': {'message': 'Rate limit exceeded'}}),
+                content_type='application/json')
+        remain -= 1
+        self.buckets[key] = (remain, now)
+        headers['x-ratelimit-remaining'] = str(int(remain))
+        headers['x-ratelimit-reset'] = str(
+            int(now + (self.limit - remain) * 60 / self.limit))
+        return headers, json.loads(body_str) if body_str else {}
+
+    def _new_order(self, d):
+        order = {
+            'orderID': str(uuid.uuid4()),
+            'symbol': d.get('symbol', 'XBTUSD'),
+            'side': 'Buy' if d.get('orderQty', 0) > 0 else 'Sell',
+            'orderQty': abs(d.get('orderQty', 0)),
+            'price': d.get('price'),
+            'execInst': d.get('execInst', ''),
+            'ordStatus': 'New',
+            'timestamp': iso_now(),
+        }
+        self.orders[order['orderID']] = order
+        self.order_log.append((time.time(), order))
+        return order
+
+    async def post_order(self, request):
+        headers, d = await self._begin(request)
+        return web.json_response(self._new_order(d), headers=headers)
+
+    async def post_order_bulk(self, request):
+        headers, d = await self._begin(request)
+        orders = [self._new_order(o) for o in json.loads(d['orders'])]
+        return web.json_response(orders, headers=headers)
+
+    async def put_order_bulk(self, request):
+        headers, d = await self._begin(request)
+        ret = []
+        for amend in json.loads(d['orders']):
+            order = self.orders.get(amend['orderID'])
+            if order is None:
+                continue
+            if 'orderQty' in amend:
+                order['orderQty'] = abs(amend['orderQty'])
+            if 'price' in amend:
+                order['price'] = amend['price']
+            ret.append(order)
+        return web.json_response(ret, headers=headers)
+
+    async def delete_order(self, request):
+        headers, d = await self._begin(request)
+        ids = d.get('orderID', '[]')
+        ids = json.loads(ids) if isinstance(ids, str) else ids
+        ret = []
+        for iid in ids:
+            order = self.orders.get(iid)
+            if order is not None:
+                order['ordStatus'] = 'Canceled'
+                ret.append(order)
+        return web.json_response(ret, headers=headers)
+
+    async def get_position(self, request):
+        headers, d = await self._begin(request)
+        symbols = self.symbols
+        if 'filter' in request.query:
+            symbol = json.loads(request.query['filter']).get('symbol')
+            symbols = [s for s in symbols if s == symbol]
+        ret = [{'account': 1, 'symbol': s, 'currency': 'XBt',
+                'leverage': self.leverage[s], 'currentQty': 0}
+               for s in symbols]
+        return web.json_response(ret, headers=headers)
+
+    async def post_position_leverage(self, request):
+        headers, d = await self._begin(request)
+        self.leverage[d['symbol']] = d['leverage']
+        return web.json_response(
+            {'account': 1, 'symbol': d['symbol'], 'currency': 'XBt',
+             'leverage': d['leverage'], 'currentQty': 0}, headers=headers)
+
+    async def get_user_wallet(self, request):
+        headers, d = await self._begin(request)
+        return web.json_response(
+            {'account': 1, 'currency': request.query.get('currency', 'XBt'),
+             'amount': 100000000}, headers=headers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='local bitmex stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='websocket messages per second per connection')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--limit', type=int, default=60,
+                        help='requests per minute')
+    parser.add_argument('--levels', type=int, default=500)
+    parser.add_argument('--symbols', default='XBTUSD')
+    args = parser.parse_args()
+
+    BitmexFakeServer(args.host, args.port, args.rate, args.latency,
+                     args.jitter, args.limit, args.levels,
+                     args.symbols.split(',')).run_forever()
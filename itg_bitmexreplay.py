@@ -0,0 +1,178 @@
+# coding: utf-8
+import queue
+import struct
+import threading
+import time
+import zlib
+
+# 레코드 = 헤더(수신시각 float64, 길이 uint32) + 원문(utf-8)
+RECORD_HEADER = struct.Struct('<dI')
+# 청크 = 헤더(압축된 길이 uint32) + 레코드들을 zlib 로 압축한 것
+CHUNK_HEADER = struct.Struct('<I')
+# 파일 헤더 = 매직 + 형식 버전, 파일을 만들 때 한번 쓴다.
+FILE_HEADER = b'ITGREC' + struct.pack('<H', 1)
+
+
+def check_header(head, path):
+    if head != FILE_HEADER:
+        raise ValueError('not a BitmexRecorder log (or unknown version): %s'
+                         % path)
+
+
+class BitmexRecorder:
+    """
+    웹소켓 수신 원문을 수신시각과 함께 로그에 append 로 기록
+    ex) wapi.recorder = BitmexRecorder('xbtusd_20180301.log')
+    압축/쓰기는 백그라운드 스레드가 하므로 수신 스레드는 큐에 넣기만 한다.
+    flush_sec 마다(또는 chunk_size 바이트가 모이면) 모인 레코드를 독립된 zlib 청크 하나로
+    압축해서 쓴다. 비정상 종료시 잃는 것은 마지막 flush_sec 동안의 기록뿐이고,
+    같은 경로를 다시 열어도 이어서 청크를 붙이므로 이전 기록이 깨지지 않는다.
+    """
+    def __init__(self, path, flush_sec=1.0, compresslevel=6,
+                 chunk_size=1 << 20):
+        self.path = path
+        self.flush_sec = flush_sec
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.count = 0  # 기록한 메시지 수
+        self._f = open(path, 'ab')
+        self._repair()
+        self._buf = bytearray()
+        self._q = queue.SimpleQueue()
+        self._th = threading.Thread(target=self._run, daemon=True)
+        self._th.start()
+
+    def _repair(self):
+        """
+        새 파일이면 파일 헤더를 쓰고, 이어쓰기면 비정상 종료로 잘린 마지막 청크를 잘라낸다.
+        """
+        end = self._f.seek(0, 2)
+        if end < len(FILE_HEADER):
+            with open(self.path, 'rb') as f:
+                head = f.read()
+            if not FILE_HEADER.startswith(head):
+                self._f.close()
+                check_header(head, self.path)
+            # 빈 파일 (또는 헤더를 쓰다 잘린 파일)
+            self._f.truncate(0)
+            self._f.write(FILE_HEADER)
+            self._f.flush()
+            return
+        with open(self.path, 'rb') as f:
+            try:
+                check_header(f.read(len(FILE_HEADER)), self.path)
+            except ValueError:
+                self._f.close()
+                raise
+            pos = len(FILE_HEADER)
+            while pos + CHUNK_HEADER.size <= end:
+                f.seek(pos)
+                lens, = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                if pos + CHUNK_HEADER.size + lens > end:
+                    break
+                pos += CHUNK_HEADER.size + lens
+        if pos < end:
+            self._f.truncate(pos)
+
+    def write(self, message, ts=None):
+        self._q.put((time.time() if ts is None else ts, message))
+
+    def _flush(self):
+        if self._buf:
+            data = zlib.compress(bytes(self._buf), self.compresslevel)
+            self._f.write(CHUNK_HEADER.pack(len(data)) + data)
+            self._f.flush()
+            self._buf = bytearray()
+
+    def _run(self):
+        last_flush = time.time()
+        while True:
+            try:
+                itm = self._q.get(timeout=self.flush_sec)
+            except queue.Empty:
+                itm = False
+            if itm is None:  # close
+                break
+            if itm:
+                ts, message = itm
+                if isinstance(message, str):
+                    message = message.encode('utf-8')
+                self._buf += RECORD_HEADER.pack(ts, len(message))
+                self._buf += message
+                self.count += 1
+            now = time.time()
+            if (now - last_flush >= self.flush_sec or
+                    len(self._buf) >= self.chunk_size):
+                self._flush()
+                last_flush = now
+        self._flush()
+        self._f.close()
+
+    def close(self):
+        self._q.put(None)
+        self._th.join()
+
+
+class BitmexReplayer:
+    """
+    BitmexRecorder 로그를 읽어 메시지큐(또는 BitmexDispatcher)에 다시 넣는다.
+    speed: 1 이면 실제 시간간격대로, N 이면 N배속, None(또는 0)이면 최대속도
+    로그는 청크 단위로 읽으므로 파일 전체를 메모리에 올리지 않는다.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        """
+        (수신시각, 원문) 제네레이터, 기록중 잘린 마지막 청크(레코드)는 무시
+        BitmexRecorder 로그가 아니면 ValueError
+        """
+        with open(self.path, 'rb') as f:
+            head = f.read(len(FILE_HEADER))
+            if not head:  # 빈 파일
+                return
+            check_header(head, self.path)
+            while True:
+                head = f.read(CHUNK_HEADER.size)
+                if len(head) < CHUNK_HEADER.size:
+                    return
+                lens, = CHUNK_HEADER.unpack(head)
+                data = f.read(lens)
+                if len(data) < lens:
+                    return
+                try:
+                    data = zlib.decompress(data)
+                except zlib.error:
+                    return
+                pos = 0
+                while pos + RECORD_HEADER.size <= len(data):
+                    ts, lens = RECORD_HEADER.unpack_from(data, pos)
+                    pos += RECORD_HEADER.size
+                    yield ts, data[pos:pos + lens].decode('utf-8')
+                    pos += lens
+
+    def replay(self, target, speed=1.0):
+        """
+        target.put(원문) 으로 재생 (블로킹), 재생한 메시지 수를 반환
+        """
+        count = 0
+        start = None
+        for ts, message in self:
+            if speed:
+                if start is None:
+                    start = (ts, time.time())
+                wait = (ts - start[0]) / speed - (time.time() - start[1])
+                if wait > 0:
+                    time.sleep(wait)
+            target.put(message)
+            count += 1
+        return count
+
+    def start(self, target, speed=1.0):
+        """
+        BitmexWebsocket 처럼 백그라운드 스레드에서 재생
+        """
+        th = threading.Thread(target=self.replay, args=(target, speed),
+                              daemon=True)
+        th.start()
+        return th
@@ -0,0 +1,144 @@
+# coding: utf-8
+"""
+심볼을 여러 워커 프로세스로 나눠서 오더북을 유지 (코어 하나 한계를 넘기 위함)
+앞단(BitmexShardedBooks.plexing)은 orderBookL2 행을 symbol 로 분류해서 담당 워커 큐에
+넣기만 하고, 워커는 자기 심볼의 WsOrderBooks 를 갱신한 뒤 공유메모리에 호가를 발행한다.
+한 심볼에 메시지가 몰려도 다른 워커의 심볼은 밀리지 않는다.
+
+ex) books = BitmexShardedBooks(workers=4)
+    dispatcher.register('orderBookL2', books.plexing)
+    books.gen_buys('XBTUSD', 5)          # 워커에 질의
+    books.reader('XBTUSD').read()        # 공유메모리로 직접 읽기
+"""
+import itertools
+import multiprocessing
+import threading
+
+from itgaecoin.itg_bitmexapi import BitmexUtil
+from itgaecoin.itg_bitmexshm import BitmexShmPublisher, BitmexShmReader
+
+# 워커에 질의할 수 있는 WsOrderBooks 메소드
+QUERY_METHODS = ('gen_buys', 'gen_slls', 'depth_view', 'liquidity_within')
+
+
+def run_shard(in_q, out_q, depth, prefix, book_class):
+    """
+    워커 프로세스에서 수행되는 함수
+    in_q: ('rows', action, rows) | ('query', qid, method, args) | ('stop',)
+    """
+    books = BitmexUtil.WsOrderBooks(getattr(BitmexUtil, book_class))
+    pub = BitmexShmPublisher(books, depth, prefix) if depth > 0 else None
+    while True:
+        msg = in_q.get()
+        if msg[0] == 'rows':
+            d = {'data': msg[2]}
+            books.plexing('orderBookL2', msg[1], d)
+            if pub is not None:
+                pub.plexing('orderBookL2', msg[1], d)
+        elif msg[0] == 'query':
+            qid, method, args = msg[1:]
+            try:
+                ret = getattr(books, method)(*args)
+                if method in ('gen_buys', 'gen_slls'):
+                    ret = list(ret)
+                out_q.put((qid, ret, None))
+            except Exception as e:
+                out_q.put((qid, None, e))
+        else:
+            break
+    if pub is not None:
+        pub.close()
+
+
+class BitmexShardedBooks:
+    """
+    워커 프로세스별로 심볼을 나눠 가진 WsOrderBooks
+    심볼은 처음 나타날 때 가장 적게 맡은 워커에 배정 (symbols 로 직접 지정 가능)
+    depth > 0 이면 워커가 공유메모리(prefix_symbol)에 1차 ~ depth차 호가 발행
+    """
+    def __init__(self, workers=2, depth=25, prefix='itg',
+                 book_class='WsSortedOrderBook', symbols=None):
+        ctx = multiprocessing.get_context('spawn')  # 수신 스레드가 있으므로 fork 대신
+        self.depth = depth
+        self.prefix = prefix
+        self.assign = dict(symbols or {})  # key: symbol, 워커 번호
+        self.out_q = ctx.Queue()
+        self.shards = []  # (process, in_q)
+        for _ in range(workers):
+            in_q = ctx.Queue()
+            proc = ctx.Process(target=run_shard,
+                               args=(in_q, self.out_q, depth, prefix,
+                                     book_class),
+                               daemon=True)
+            proc.start()
+            self.shards.append((proc, in_q))
+        self._loads = [0] * workers
+        for idx in self.assign.values():
+            self._loads[idx] += 1
+        self._qid = itertools.count()
+        self._results = {}
+        self._lock = threading.Lock()
+        # 수신 스레드(plexing)와 조회 스레드(query)가 같이 배정하므로 따로 잠근다.
+        # (self._lock 은 조회 결과를 기다리는 동안 잡고 있으므로 쓰지 않음)
+        self._assign_lock = threading.Lock()
+
+    def _shard(self, symbol):
+        idx = self.assign.get(symbol)
+        if idx is None:
+            with self._assign_lock:
+                idx = self.assign.get(symbol)
+                if idx is None:
+                    idx = self._loads.index(min(self._loads))
+                    self._loads[idx] += 1
+                    self.assign[symbol] = idx
+        return idx
+
+    def plexing(self, table, action, d):
+        if 'orderBookL2' == table:
+            # 워커별로 묶어서 메시지당 워커마다 한번만 넣는다
+            grouped = {}
+            for t in d['data']:
+                idx = self._shard(t['symbol'])
+                rows = grouped.get(idx)
+                if rows is None:
+                    rows = grouped[idx] = []
+                rows.append(t)
+            for idx, rows in grouped.items():
+                self.shards[idx][1].put(('rows', action, rows))
+
+    def query(self, symbol, method, *args):
+        """
+        심볼 담당 워커에서 WsOrderBooks.method(symbol, *args) 결과를 받는다 (블로킹)
+        앞서 넣은 메시지가 모두 반영된 뒤의 결과
+        """
+        if method not in QUERY_METHODS:
+            raise ValueError('unknown query: %s' % method)
+        idx = self._shard(symbol)
+        with self._lock:
+            qid = next(self._qid)
+            self.shards[idx][1].put(('query', qid, method, (symbol,) + args))
+            while qid not in self._results:
+                rid, ret, err = self.out_q.get()
+                self._results[rid] = (ret, err)
+            ret, err = self._results.pop(qid)
+        if err is not None:
+            raise err
+        return ret
+
+    def gen_buys(self, symbol, limit=20):
+        return self.query(symbol, 'gen_buys', limit)
+
+    def gen_slls(self, symbol, limit=20):
+        return self.query(symbol, 'gen_slls', limit)
+
+    def reader(self, symbol):
+        """
+        공유메모리 호가 구독 객체 (depth > 0 일때, 심볼의 첫 메시지 이후)
+        """
+        return BitmexShmReader(symbol, self.prefix, untrack=False)
+
+    def close(self):
+        for proc, in_q in self.shards:
+            in_q.put(('stop',))
+        for proc, in_q in self.shards:
+            proc.join()
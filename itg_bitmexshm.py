@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+공유메모리 호가 발행/구독, 여러 전략 프로세스가 웹소켓 하나의 오더북을 나눠 쓴다.
+심볼마다 공유메모리 블록 하나 (이름: prefix_symbol)
+  header int64[6]: seq, version, depth, n_buys, n_slls, ts(ns)
+  data float64[4 * depth]: 매수가격, 매수수량, 매도가격, 매도수량 (1차호가부터)
+seq 는 시퀀스락, 쓰는 동안 홀수이고 다 쓰면 짝수가 된다. 읽는 쪽은 읽기 전후
+seq 가 같고 짝수일 때만 그 값을 사용한다. (IPC 왕복, 잠금 없음)
+(주의점: 쓰는 프로세스는 하나, x86 처럼 store 순서가 보장되는 CPU 를 전제함)
+
+ex) # 발행 프로세스
+    pub = BitmexShmPublisher(books, depth=25)
+    dispatcher.register('orderBookL2', books.plexing)
+    dispatcher.register('orderBookL2', pub.plexing)
+    # 전략 프로세스
+    reader = BitmexShmReader('XBTUSD')
+    version, ts, buy_px, buy_qty, sll_px, sll_qty = reader.read()
+"""
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np  # 3rd party lib(https://pypi.python.org/pypi/numpy)
+
+HEADER_LEN = 6
+SEQ, VERSION, DEPTH, N_BUYS, N_SLLS, TS = range(HEADER_LEN)
+
+
+def shm_name(prefix, symbol):
+    return '%s_%s' % (prefix, symbol)
+
+
+def shm_views(buf, depth):
+    """
+    공유메모리 버퍼 위의 (header, data) numpy 뷰, 복사하지 않는다.
+    """
+    header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=buf)
+    data = np.ndarray((4, depth), dtype=np.float64, buffer=buf,
+                      offset=HEADER_LEN * 8)
+    return header, data
+
+
+class BitmexShmPublisher:
+    """
+    WsOrderBooks 의 1차 ~ depth차 호가를 심볼별 공유메모리에 발행
+    plexing 을 WsOrderBooks.plexing 다음에 호출하면 바뀐 심볼만 다시 쓴다.
+    """
+    def __init__(self, books, depth=25, prefix='itg'):
+        self.books = books  # type: BitmexUtil.WsOrderBooks
+        self.depth = depth
+        self.prefix = prefix
+        self.blocks = {}  # key: symbol, (SharedMemory, header, data)
+
+    def _block(self, symbol):
+        blk = self.blocks.get(symbol)
+        if blk is None:
+            size = HEADER_LEN * 8 + 4 * self.depth * 8
+            name = shm_name(self.prefix, symbol)
+            try:
+                shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:  # 이전 실행이 남긴 블록 재사용
+                shm = shared_memory.SharedMemory(name)
+                if shm.size < size:  # 더 작은 depth 로 만든 블록이면 새로 만든다.
+                    shm.close()
+                    shm.unlink()
+                    shm = shared_memory.SharedMemory(name, create=True,
+                                                     size=size)
+            header, data = shm_views(shm.buf, self.depth)
+            header[:] = 0
+            header[DEPTH] = self.depth
+            blk = self.blocks[symbol] = (shm, header, data)
+        return blk
+
+    def plexing(self, table, action, d):
+        if 'orderBookL2' == table:
+            for symbol in {t['symbol'] for t in d['data']}:
+                self.publish(symbol)
+
+    def publish(self, symbol):
+        book = self.books.books.get(symbol)
+        if book is None:
+            return
+        shm, header, data = self._block(symbol)
+        buy_px, buy_qty = book.top_levels('Buy', self.depth)
+        sll_px, sll_qty = book.top_levels('Sell', self.depth)
+        nb = len(buy_px)
+        ns = len(sll_px)
+
+        header[SEQ] += 1  # 홀수: 쓰는중
+        data[0, :nb] = buy_px
+        data[1, :nb] = buy_qty
+        data[2, :ns] = sll_px
+        data[3, :ns] = sll_qty
+        header[N_BUYS] = nb
+        header[N_SLLS] = ns
+        header[VERSION] += 1
+        header[TS] = time.time_ns()
+        header[SEQ] += 1  # 짝수: 완료
+
+    def publish_all(self):
+        for symbol in list(self.books.books.keys()):
+            self.publish(symbol)
+
+    def close(self):
+        for shm, header, data in self.blocks.values():
+            del header, data
+            shm.close()
+            shm.unlink()
+        self.blocks = {}
+
+
+class BitmexShmReader:
+    """
+    다른 프로세스에서 BitmexShmPublisher 가 발행한 호가를 읽는다.
+    read() 는 일관된 값의 복사본(depth 개), views 는 복사없는 뷰
+    (뷰를 직접 쓸 때는 begin() 으로 seq 를 받고 사용후 validate(seq) 로 확인)
+    untrack: 읽는 프로세스가 끝날 때 블록이 지워지지 않도록 resource_tracker 에서 뺀다.
+    발행 프로세스와 tracker 를 공유하는 경우(발행쪽의 부모/자식 프로세스)는 False
+    """
+    def __init__(self, symbol, prefix='itg', untrack=True):
+        self.symbol = symbol
+        self.shm = shared_memory.SharedMemory(shm_name(prefix, symbol))
+        if untrack:  # 발행쪽이 unlink
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        depth = int(np.ndarray((HEADER_LEN,), dtype=np.int64,
+                               buffer=self.shm.buf)[DEPTH])
+        self.header, self.data = shm_views(self.shm.buf, depth)
+
+    @property
+    def views(self):
+        return self.header, self.data
+
+    def begin(self):
+        """
+        쓰는 중이 아닐 때까지 기다렸다가 seq 반환
+        """
+        while True:
+            seq = int(self.header[SEQ])
+            if not seq & 1:
+                return seq
+
+    def validate(self, seq):
+        return int(self.header[SEQ]) == seq
+
+    def read(self):
+        """
+        (version, ts(ns), 매수가격, 매수수량, 매도가격, 매도수량) 일관된 복사본
+        """
+        header = self.header
+        data = self.data
+        while True:
+            seq = self.begin()
+            nb = int(header[N_BUYS])
+            ns = int(header[N_SLLS])
+            version = int(header[VERSION])
+            ts = int(header[TS])
+            buys = data[:2, :nb].copy()
+            slls = data[2:, :ns].copy()
+            if self.validate(seq):
+                return version, ts, buys[0], buys[1], slls[0], slls[1]
+
+    def close(self):
+        del self.header, self.data
+        self.shm.close()
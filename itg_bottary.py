@@ -1,27 +1,28 @@
 # coding: utf-8
 import math
 import re
-import urllib.request
+import threading
+import time
 
 import itgaecoin.itg_orderbooks as orderbooks
 
 
 # 달러 환율
-def usdex_coinone() -> float:
-    jsoned = orderbooks.get_url_by_json('https://api.coinone.co.kr/currency/')
+def usdex_coinone(timeout=orderbooks.TIMEOUT) -> float:
+    jsoned = orderbooks.get_url_by_json('https://api.coinone.co.kr/currency/',
+                                        timeout)
     rate = float(jsoned['currency'])
     return rate
 
 
-def usdex_naver() -> float:
+def usdex_naver(timeout=orderbooks.TIMEOUT) -> float:
     """
     네이버 USDKRW 환율 최신 고시회차 기준환율 (regex사용, Web Scrap, KEB하나은행)
     :return: usd-krw rate
     """
     url_str = 'http://info.finance.naver.com/marketindex/exchangeDegreeCount' \
               'Quote.nhn?marketindexCd=FX_USDKRW'
-    res = urllib.request.urlopen(url_str)
-    txt = res.read().decode('euc-kr')  # 인코딩 유의
+    txt = orderbooks.get_url(url_str, timeout).decode('euc-kr')  # 인코딩 유의
 
     pattern = re.compile(r'<tr class="up">\s+<td class="count">([^<]*)</td>\s+'
                          r'<td class="num">([^<]*)</td>')
@@ -36,6 +37,89 @@ def usdex_naver() -> float:
     return rate
 
 
+class UsdexCache:
+    """
+    USDKRW 환율 캐시, get() 은 메모리의 값을 바로 반환 (O(1), 첫 호출만 대기)
+    ttl 초가 지나면 get() 이 백그라운드 스레드로 다시 가져오게 하고 그동안은 이전 값을 준다.
+    (stale-while-revalidate) sources 순서대로 시도해서 실패하면 다음 소스,
+    모두 실패하면 이전 값을 유지하고 retry 초 뒤에 다시 시도한다.
+    """
+    def __init__(self, sources=None, ttl=600.0, retry=30.0):
+        # (이름, 환율 함수) 우선순위 순서
+        self.sources = sources or (('naver', usdex_naver),
+                                   ('coinone', usdex_coinone))
+        self.ttl = ttl
+        self.retry = retry
+        self.rate = None     # 마지막으로 받은 환율
+        self.source = None   # 마지막 환율의 소스 이름
+        self.updated = None  # 마지막으로 받은 시각 (time.monotonic)
+        self.errors = {}     # key: 소스 이름, 마지막 실패 내용
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self) -> float:
+        """
+        sources 순서대로 환율을 받아서 갱신 (블로킹), 모두 실패하면 이전 값
+        """
+        for name, func in self.sources:
+            try:
+                rate = func()
+            except Exception as e:
+                self.errors[name] = '%s: %s' % (type(e).__name__, e)
+                continue
+            self.errors.pop(name, None)
+            self.rate, self.source = rate, name
+            self.updated = time.monotonic()
+            self._next_at = self.updated + self.ttl
+            return rate
+        self._next_at = time.monotonic() + self.retry
+        if self.rate is None:
+            raise Exception('usdex not available: %s' % self.errors)
+        return self.rate
+
+    def _refresh_bg(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+        finally:
+            self._refreshing = False
+
+    def get(self) -> float:
+        if self.rate is None:  # 아직 값이 없으면 기다린다
+            with self._lock:
+                if self.rate is None:
+                    return self.refresh()
+        if time.monotonic() >= self._next_at and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_bg,
+                                     daemon=True).start()
+        return self.rate
+
+    @property
+    def age(self):
+        """
+        마지막으로 받은지 지난 시간(초)
+        """
+        if self.updated is None:
+            return None
+        return time.monotonic() - self.updated
+
+
+# 기본 환율 캐시
+USDEX = UsdexCache()
+
+
+def usdex() -> float:
+    """
+    캐시된 USDKRW 환율 (naver, 실패하면 coinone)
+    """
+    return USDEX.get()
+
+
 def check_premium(a_spread, b_spread, a_ex, b_ex) -> dict:
     """
     두개의 스프레드를 비교 프리미엄을 알아낸다.
@@ -98,4 +182,4 @@ def check_bottary(*args):
 
 
 if __name__ == "__main__":
-    print(usdex_naver())
+    print(usdex(), USDEX.source)
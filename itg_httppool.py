@@ -0,0 +1,167 @@
+# coding: utf-8
+"""
+keep-alive HTTP(S) 커넥션 풀 (표준 라이브러리만 사용)
+BitmexAPI 와 거래소 호가 조회(itg_orderbooks) 가 같이 쓴다.
+"""
+import http.client
+import io
+import queue
+import select
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+
+# 따라가는 리다이렉트 응답
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class HTTPPoolResponse:
+    """
+    HTTPPool 응답, 본문을 미리 읽고 커넥션은 풀에 반납된 상태
+    HTTPResponse 처럼 status, read(), getheader() 사용
+    """
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # type: http.client.HTTPMessage
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class HTTPPool:
+    """
+    keep-alive HTTP(S) 커넥션 풀, 매 요청마다 TCP 연결/TLS 핸드셰이크를 하지 않는다.
+    최대 size 개 커넥션을 여러 스레드가 나눠 쓰며 모두 사용중이면 대기,
+    끊어진 커넥션은 재사용 전에 검사하고, 재사용한 커넥션이 실패하면
+    멱등 요청(GET 등)만 새 커넥션으로 한번 재시도한다.
+    urlopen 과 같이 4xx, 5xx 응답은 urllib.error.HTTPError
+    """
+    IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+    def __init__(self, base_url, size=4):
+        url = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.size = size
+        self.idle = queue.LifoQueue()  # 최근 쓴 커넥션부터 재사용
+        self.slots = threading.BoundedSemaphore(size)
+        self.opened = 0   # 새로 연 커넥션 수
+        self.retried = 0  # 끊어진 커넥션으로 재시도한 수
+
+    def _new_conn(self, timeout):
+        self.opened += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=timeout,
+                context=ssl.create_default_context())
+        return http.client.HTTPConnection(self.host, self.port,
+                                          timeout=timeout)
+
+    def _get_conn(self, timeout):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return self._new_conn(timeout), False
+            # 유휴 커넥션에 읽을 것이 있다면 서버가 닫은 것 (EOF)
+            if conn.sock is None or select.select([conn.sock], [], [], 0)[0]:
+                conn.close()
+                continue
+            conn.timeout = timeout
+            conn.sock.settimeout(timeout)
+            return conn, True
+
+    def request(self, method, path, body, headers, timeout=None):
+        with self.slots:
+            conn, reused = self._get_conn(timeout)
+            try:
+                conn.request(method, path, body, headers)
+                res = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError,
+                    http.client.BadStatusLine):
+                conn.close()
+                if not reused or method not in self.IDEMPOTENT:
+                    raise
+                self.retried += 1
+                conn = self._new_conn(timeout)
+                try:
+                    conn.request(method, path, body, headers)
+                    res = conn.getresponse()
+                except Exception:
+                    conn.close()
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+            try:
+                data = res.read()
+            except Exception:
+                conn.close()
+                raise
+            if res.will_close:
+                conn.close()
+            else:
+                self.idle.put(conn)
+
+        if res.status >= 400:
+            raise urllib.error.HTTPError(
+                self.base_url + path, res.status, res.reason, res.headers,
+                io.BytesIO(data))
+        return HTTPPoolResponse(res.status, res.reason, res.headers, data)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# key: scheme://host, 호스트별 커넥션 풀
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(base_url, size=4) -> HTTPPool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(base_url)
+        if pool is None:
+            pool = _POOLS[base_url] = HTTPPool(base_url, size)
+        return pool
+
+
+def close_pools():
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+
+def urlget(url_str, headers, timeout=None, max_redirects=5) -> HTTPPoolResponse:
+    """
+    호스트별 풀로 GET, urlopen 과 같이 리다이렉트(3xx)는 Location 을 따라간다.
+    """
+    for _ in range(max_redirects + 1):
+        url = urllib.parse.urlsplit(url_str)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        pool = get_pool('%s://%s' % (url.scheme, url.netloc))
+        res = pool.request('GET', path, None, headers, timeout)
+        if res.status < 300:
+            return res
+        location = res.getheader('Location')
+        if res.status not in REDIRECTS or not location:
+            break
+        url_str = urllib.parse.urljoin(url_str, location)
+    raise urllib.error.HTTPError(url_str, res.status, res.reason, res.headers,
+                                 io.BytesIO(res.body))
@@ -1,32 +1,46 @@
 # coding: utf-8
+import abc
+import collections
+import concurrent.futures
 import json
 # get request
 import time
-import urllib.request
-from queue import Queue
-from threading import Thread
+import types
 from typing import Generator
 
+# 거래소별 keep-alive 커넥션 풀
+from itgaecoin.itg_httppool import urlget
+
 REQ_HEADER = {
     'User-Agent': 'ozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 '
                   '(KHTML, like Gecko) Chrome/60.0.3112.113 Safari/537.36'
 }
 
+# 요청 하나의 기본 타임아웃(초)
+TIMEOUT = 3.0
+
 
-def get_url_by_json(url_str) -> dict:
+def get_url(url_str, timeout=TIMEOUT) -> bytes:
+    """
+    HTTP REQUEST(GET), 호스트별 keep-alive 커넥션으로 요청하고 본문(bytes)을 반환
+    리다이렉트는 따라가고 4xx, 5xx 는 urllib.error.HTTPError
+    """
+    return urlget(url_str, REQ_HEADER, timeout).read()
+
+
+def get_url_by_json(url_str, timeout=TIMEOUT) -> dict:
     """
     HTTP REQUEST(GET) and convert json
     :param url_str:  url address
+    :param timeout: 요청 타임아웃(초)
     """
-    req = urllib.request.Request(url_str, headers=REQ_HEADER)
-    res = urllib.request.urlopen(req)
-    txt = res.read().decode('utf-8')
+    txt = get_url(url_str, timeout).decode('utf-8')
     return json.loads(txt)
 
 
 # orderbook methods
 
-def book_coinone(currency) -> dict:
+def book_coinone(currency, timeout=TIMEOUT) -> dict:
     """
     coinone's order book
     :param currency:
@@ -34,10 +48,10 @@ def book_coinone(currency) -> dict:
     """
     url_str = 'https://api.coinone.co.kr/orderbook/?currency=%s&format=json' \
               % (currency.lower())
-    return get_url_by_json(url_str)
+    return get_url_by_json(url_str, timeout)
 
 
-def book_bittrex(currency, currency_base='usdt') -> dict:
+def book_bittrex(currency, currency_base='usdt', timeout=TIMEOUT) -> dict:
     """
     bittrex's order book
     :param currency:
@@ -48,28 +62,157 @@ def book_bittrex(currency, currency_base='usdt') -> dict:
     pair = '%s-%s' % (currency_base.upper(), currency.upper())
     url_str = 'https://bittrex.com/api/v1.1/public/getorderbook?market=%s' \
               '&type=both' % pair
-    return get_url_by_json(url_str)
+    return get_url_by_json(url_str, timeout)
+
+
+# 거래소 어댑터 (호가 앞쪽 몇 단계만 요청/파싱)
+
+_DECODER = json.JSONDecoder()
+
+
+def json_array_head(txt, key, count) -> list:
+    """
+    txt 의 "key": [...] 배열에서 앞의 count 개 원소만 디코딩, 나머지는 읽지 않는다.
+    값이 null 이거나 빈 배열이면 []
+    (주의점: key 는 처음 나오는 것을 사용하므로 응답 안에서 유일한 키여야 함)
+    """
+    end = len(txt)
+    pattern = '"%s"' % key
+    idx = 0
+    while True:
+        idx = txt.find(pattern, idx)
+        if idx < 0:
+            raise ValueError('no "%s" in response: %s' % (key, txt[:200]))
+        idx += len(pattern)
+        while idx < end and txt[idx] in ' \t\r\n':
+            idx += 1
+        if idx < end and txt[idx] == ':':  # 키 (값 문자열이 아님)
+            break
+    idx += 1
+    while idx < end and txt[idx] in ' \t\r\n':
+        idx += 1
+    if txt.startswith('null', idx):
+        return []
+    if idx >= end or txt[idx] != '[':
+        raise ValueError('"%s" is not an array: %s' % (key, txt[idx:idx + 50]))
+    idx += 1
+    ret = []
+    while len(ret) < count:
+        while idx < end and txt[idx] in ' \t\r\n,':
+            idx += 1
+        if idx >= end or txt[idx] == ']':
+            break
+        obj, idx = _DECODER.raw_decode(txt, idx)
+        ret.append(obj)
+    return ret
+
+
+# key: 거래소 이름, BookAdapter
+ADAPTERS = {}
+
+
+def register_adapter(cls):
+    """
+    거래소 어댑터 등록 (클래스 데코레이터), SpreadPoller 는 이름으로 찾는다.
+    등록할 때 인스턴스를 만들므로 url() 을 구현하지 않은 어댑터는 여기서 TypeError
+    """
+    ADAPTERS[cls.name] = cls()
+    return cls
+
+
+def get_adapter(name):
+    try:
+        return ADAPTERS[name]
+    except KeyError:
+        raise ValueError('unknown exchange: %s' % name) from None
+
+
+class BookAdapter(abc.ABC):
+    """
+    거래소 호가 어댑터, url() 과 응답 필드 이름만 정하면 된다.
+    top_levels 는 depth 단계만 요청하고(거래소가 지원하면) 응답도 앞쪽 depth 개만 파싱
+    RATE_LIMIT: 요청 한도 (요청수, 초)
+    """
+    name = ''
+    RATE_LIMIT = (60, 60)
+    BID_KEY = 'bid'
+    ASK_KEY = 'ask'
+    PRICE_KEY = 'price'
+    QTY_KEY = 'qty'
+
+    @abc.abstractmethod
+    def url(self, *args, depth=1) -> str:
+        pass
+
+    def parse(self, txt, depth=1) -> tuple:
+        """
+        ([(매수가격, 수량), ...], [(매도가격, 수량), ...]) 각각 depth 개까지
+        """
+        price, qty = self.PRICE_KEY, self.QTY_KEY
+        bids = [(float(t[price]), float(t[qty]))
+                for t in json_array_head(txt, self.BID_KEY, depth)]
+        asks = [(float(t[price]), float(t[qty]))
+                for t in json_array_head(txt, self.ASK_KEY, depth)]
+        return bids, asks
+
+    def top_levels(self, *args, depth=1, timeout=TIMEOUT) -> tuple:
+        txt = get_url(self.url(*args, depth=depth), timeout).decode('utf-8')
+        return self.parse(txt, depth)
+
+    def spread(self, *args, timeout=TIMEOUT) -> tuple:
+        """
+        :return:  tupe(buy_price, buy_quantity, sell_price, sell_quantity)
+        """
+        bids, asks = self.top_levels(*args, depth=1, timeout=timeout)
+        if not bids or not asks:
+            raise ValueError('empty order book: %s %s' % (self.name, args))
+        return bids[0] + asks[0]
+
+
+@register_adapter
+class CoinoneAdapter(BookAdapter):
+    """
+    coinone 은 단계 수 지정이 없으므로 응답 파싱만 줄인다.
+    """
+    name = 'coinone'
+    RATE_LIMIT = (90, 60)  # 90 requests per minute
+
+    def url(self, currency, depth=1):
+        return 'https://api.coinone.co.kr/orderbook/?currency=%s&format=json' \
+               % (currency.lower())
+
+
+@register_adapter
+class BittrexAdapter(BookAdapter):
+    """
+    bittrex 는 depth 인자로 단계 수를 줄여서 요청 (문서에 없음, 60 requests per minute 로 가정)
+    """
+    name = 'bittrex'
+    RATE_LIMIT = (60, 60)
+    BID_KEY = 'buy'
+    ASK_KEY = 'sell'
+    PRICE_KEY = 'Rate'
+    QTY_KEY = 'Quantity'
+
+    def url(self, currency, currency_base='usdt', depth=1):
+        pair = '%s-%s' % (currency_base.upper(), currency.upper())
+        return 'https://bittrex.com/api/v1.1/public/getorderbook?market=%s' \
+               '&type=both&depth=%d' % (pair, depth)
 
 
 # highest buy , lowest sell  spread
 
-def spread_coinone(currency) -> tuple:
+def spread_coinone(currency, timeout=TIMEOUT) -> tuple:
     """
     coinone's spreads
     :param currency:
     :type currency: str
     :return:  tupe(buy_price, buy_quantity, sell_price, sell_quantity)
     """
-    book = book_coinone(currency)
-    return (
-        float(book['bid'][0]['price']),
-        float(book['bid'][0]['qty']),
-        float(book['ask'][0]['price']),
-        float(book['ask'][0]['qty']),
-    )
+    return ADAPTERS['coinone'].spread(currency, timeout=timeout)
 
 
-def spread_bittrex(currency, currency_base='usdt') -> tuple:
+def spread_bittrex(currency, currency_base='usdt', timeout=TIMEOUT) -> tuple:
     """
     bittrex's spreads
     :param currency_base:
@@ -77,83 +220,204 @@ def spread_bittrex(currency, currency_base='usdt') -> tuple:
     :type currency: str
     :return:  tupe(buy_price, buy_quantity, sell_price, sell_quantity)
     """
-    book = book_bittrex(currency, currency_base)
-    return (
-        float(book['result']['buy'][0]['Rate']),
-        float(book['result']['buy'][0]['Quantity']),
-        float(book['result']['sell'][0]['Rate']),
-        float(book['result']['sell'][0]['Quantity']),
-    )
+    return ADAPTERS['bittrex'].spread(currency, currency_base, timeout=timeout)
 
 
 # request spread pair concurrently
 # [main thread call] ->  waiting           --------> ->[user logic]--->[recall]
 # [worker1]         |-> [coinone]HTTP(GET) -------->|
 # [worker2]         |-> [bittrex]HTTP(GET) -->      |
-def run_worker(task_q, result):
+# 워커는 SpreadPoller 가 살아있는 동안 재사용, 커넥션은 거래소별로 keep-alive
+
+
+class TokenBucket:
     """
-    워커 스레드에 의해 수행되는 함수
-    :param task_q:
-    :type task_q: Queue
-    :param result:
-    :return:
+    count 회 / per 초 토큰버킷, burst 개까지 몰아서 쓸 수 있다.
     """
-    while True:
-        key, func, args = task_q.get()
+    def __init__(self, count, per, burst=5):
+        self.rate = count / per  # 초당 토큰
+        self.burst = max(1, min(burst, count))
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+
+    def _fill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, now=None) -> bool:
+        self._fill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait(self, now=None) -> float:
+        """
+        토큰 하나가 찰 때까지 남은 시간(초)
+        """
+        self._fill(time.monotonic() if now is None else now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class SpreadSnapshot(collections.namedtuple(
+        'SpreadSnapshot', 'seq ts elapsed spreads latency errors updated ages')):
+    """
+    한 회차의 스프레드 결과 (불변)
+    spreads: {key: (buy_price, buy_quantity, sell_price, sell_quantity)}
+             마지막으로 받은 값, 아직 못 받았으면 None
+    latency: {key: 마지막 요청 소요시간(초)}
+    errors: {key: 실패 내용} (마지막 요청이 실패한 것만, spreads 는 그 전 값)
+    updated: 이번 회차에 요청한 key 들, ages: {key: 받은지 지난 시간(초)}
+    key 는 spread_list 항목을 '_' 로 이은 것 ex) 'coinone_eth'
+    """
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        ret = self.spreads.get(key)
+        return default if ret is None else ret
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class SpreadPoller:
+    """
+    spread_list 의 스프레드를 동시에 요청하는 엔진, poll() 한번이 한 회차
+    워커 수가 정해진 스레드풀과 거래소별 keep-alive 커넥션을 계속 재사용한다.
+    요청마다 timeout 을 두므로 느린 거래소 하나가 회차 전체를 붙잡지 않는다.
+    spread_list 의 첫 항목은 register_adapter 로 등록된 거래소 이름
+    거래소마다 어댑터 RATE_LIMIT 크기의 토큰버킷을 두고, 항목별 요청 간격은
+    호가가 바뀌면 절반으로(최소: 거래소 한도), 그대로면 1.5배로(최대: max_interval)
+    조절한다. 따라서 poll() 은 요청할 항목이 생길 때까지 기다린다.
+    ex) spread_list = [('coinone', 'eth'), ('bittrex','eth','btc'),...]
+    """
+    def __init__(self, spread_list, timeout=TIMEOUT, workers=None,
+                 limits=None, max_interval=10.0):
+        self.spread_list = [tuple(spread) for spread in spread_list]
+        self.keys = ['_'.join(spread) for spread in self.spread_list]
+        self.timeout = timeout
+        self.max_interval = max_interval
+        self.seq = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or min(len(self.spread_list), 8) or 1,
+            thread_name_prefix='spread')
+        limits = limits or {}
+        self.adapters = [get_adapter(spread[0]) for spread in self.spread_list]
+        self.buckets = {}  # key: 거래소, TokenBucket
+        for adapter in self.adapters:
+            if adapter.name not in self.buckets:
+                self.buckets[adapter.name] = TokenBucket(
+                    *limits.get(adapter.name, adapter.RATE_LIMIT))
+        n = len(self.spread_list)
+        self.min_intervals = [1 / self.buckets[spread[0]].rate
+                              for spread in self.spread_list]
+        self.intervals = list(self.min_intervals)
+        self.next_at = [0.0] * n
+        self.spreads = [None] * n
+        self.latency = [None] * n
+        self.errors = [None] * n
+        self.fetched_at = [None] * n
+
+    def _fetch(self, i):
+        start = time.perf_counter()
         try:
-            r = func(*args)
-            if r:
-                result[key] = r
+            ret = self.adapters[i].spread(*self.spread_list[i][1:],
+                                          timeout=self.timeout)
+            err = None
         except Exception as e:
-            print(e)
-        task_q.task_done()
+            ret = None
+            err = '%s: %s' % (type(e).__name__, e)
+        return ret, time.perf_counter() - start, err
+
+    def _due(self):
+        """
+        요청 시각이 되었고 거래소 토큰이 있는 항목들, 없으면 생길 때까지 대기
+        """
+        while True:
+            now = time.monotonic()
+            picked = []
+            for i in sorted(range(len(self.keys)), key=self.next_at.__getitem__):
+                if self.next_at[i] > now:
+                    break
+                bucket = self.buckets[self.spread_list[i][0]]
+                if bucket.take(now):
+                    picked.append(i)
+                else:
+                    self.next_at[i] = now + bucket.wait(now)
+            if picked:
+                return picked
+            time.sleep(max(0.0, min(self.next_at) - time.monotonic()))
 
+    def _adapt(self, i, ret, err, now):
+        interval = self.intervals[i]
+        if err is not None:
+            interval *= 2
+        elif ret != self.spreads[i]:  # 움직이는 호가는 더 자주
+            interval /= 2
+        else:  # 조용한 호가는 덜 자주
+            interval *= 1.5
+        interval = min(self.max_interval, max(self.min_intervals[i], interval))
+        self.intervals[i] = interval
+        self.next_at[i] = now + interval
 
-def iter_spread_with_threadpool(spread_list) -> Generator[dict, None, None]:
+    def poll(self) -> SpreadSnapshot:
+        picked = self._due()
+        start = time.perf_counter()
+        futures = [self.executor.submit(self._fetch, i) for i in picked]
+        # 소켓 타임아웃 외에 회차 전체에도 한도를 둔다 (DNS 등)
+        done, _ = concurrent.futures.wait(futures, timeout=self.timeout * 2)
+        now = time.monotonic()
+        for i, fut in zip(picked, futures):
+            if fut in done:
+                ret, self.latency[i], err = fut.result()
+            else:
+                fut.cancel()
+                ret, self.latency[i] = None, time.perf_counter() - start
+                err = 'timeout'
+            self._adapt(i, ret, err, now)
+            self.errors[i] = err
+            if err is None:
+                self.spreads[i] = ret
+                self.fetched_at[i] = now
+        self.seq += 1
+        keys = self.keys
+        return SpreadSnapshot(
+            self.seq, time.time(), time.perf_counter() - start,
+            types.MappingProxyType(dict(zip(keys, self.spreads))),
+            types.MappingProxyType(dict(zip(keys, self.latency))),
+            types.MappingProxyType({keys[i]: err for i, err
+                                    in enumerate(self.errors) if err}),
+            tuple(keys[i] for i in picked),
+            types.MappingProxyType({
+                key: None if at is None else now - at
+                for key, at in zip(keys, self.fetched_at)}))
+
+    def __iter__(self):
+        while True:
+            yield self.poll()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def iter_spread_with_threadpool(spread_list, timeout=TIMEOUT, workers=None,
+                                limits=None) -> Generator[SpreadSnapshot, None, None]:
     """
     A generator that requests a spread using thread pool.
-    스레드풀을 이용하여 스프레드를 요청하는 제네레이터
+    스레드풀을 이용하여 스프레드를 요청하는 제네레이터 (회차마다 SpreadSnapshot)
+    거래소별 요청 한도는 SpreadPoller 가 지키므로 호출하는 쪽에서 sleep 하지 않아도 된다.
     ex) spread_list = [('coinone', 'eth'), ('bittrex','eth','btc'),...]
     :param spread_list:
     :type spread_list: list[tuple]
     :return: generator
     """
-    # make task queue
-    length_of_list = len(spread_list)
-    task_q = Queue(length_of_list)
-    result = {}  # type: dict
-
-    # func map
-    func_map = {
-        'coinone': spread_coinone,
-        'bittrex': spread_bittrex,
-    }
-
-    # start thread pool
-    for _ in range(length_of_list):
-        thread = Thread(target=run_worker, args=(task_q, result), daemon=True)
-        thread.start()
-
-    while True:
-        # start
-        start = time.time()
-        # add tasks
-        for spread in spread_list:
-            key = '_'.join(spread)
-            result[key] = None
-            func = func_map[spread[0]]
-            args = spread[1:]
-            task_q.put((key, func, args))
-        # wait completion
-        task_q.join()
-        # end
-        elasped = time.time() - start
-        result['elapsed'] = '%s' % elasped
-
-        # be careful request rate limit
-        # coinone : 90 requests per minute
-        # bittrex: ??
-        yield result
+    poller = SpreadPoller(spread_list, timeout, workers, limits)
+    try:
+        yield from poller
+    finally:
+        poller.close()
 
 
 if __name__ == "__main__":
@@ -167,14 +431,19 @@ if __name__ == "__main__":
     ]
 
     for ret in iter_spread_with_threadpool(spreads):
-        usdex = bottary.usdex_naver()
+        if ret.errors:
+            print(ret.errors)
+        if not {'coinone_eth', 'bittrex_eth'} & set(ret.updated):
+            continue
+        if ret.get('coinone_eth') is None or ret.get('bittrex_eth') is None:
+            continue
+        usdex = bottary.usdex()  # 캐시된 환율, 갱신은 백그라운드
         print(usdex)
 
         bot = bottary.check_premium(
-            ret['coinone_eth'],
-            ret['bittrex_eth'],
+            ret.spreads['coinone_eth'],
+            ret.spreads['bittrex_eth'],
             1,
             usdex
         )
         print(bot)
-        time.sleep(5)  # check rate limit
@@ -0,0 +1,81 @@
+# coding: utf-8
+"""
+N 거래소 x M 코인 프리미엄 (numpy 일괄 계산), itg_bottary.check_premium 의 배열판
+itg_bottary 가 numpy 없이도 쓰일 수 있도록 따로 둔다.
+"""
+import collections
+
+import numpy as np  # 3rd party lib(https://pypi.python.org/pypi/numpy)
+
+
+class PremiumMatrix(collections.namedtuple('PremiumMatrix',
+                                           'buy sll qty pft')):
+    """
+    premium_matrix 결과, 각각 (N, N, M) 배열
+    [a, b, m] = 코인 m 을 a 거래소에서 매수(매도1호가), b 거래소에서 매도(매수1호가)
+    buy: a 매도1호가, sll: b 매수1호가, qty: 두 잔량중 적은 쪽, pft: 원화 기준 수익률
+    (a == b 이거나 호가가 없으면(nan) pft 는 nan)
+    """
+    __slots__ = ()
+
+
+# top_premiums 결과 레코드
+PREMIUM_DTYPE = np.dtype([('long', np.int64), ('short', np.int64),
+                          ('coin', np.int64), ('buy', np.float64),
+                          ('sll', np.float64), ('qty', np.float64),
+                          ('pft', np.float64)])
+
+
+def premium_matrix(bid_px, bid_qty, ask_px, ask_qty, ex) -> PremiumMatrix:
+    """
+    모든 (a, b) 거래소 순서쌍과 코인의 프리미엄을 한번에 계산, check_premium 과 같이
+    원화 가격은 내림(floor)한 뒤 수익률을 구한다. (check_premium 의 long_short 가 [a, b],
+    short_long 이 [b, a])
+    :param bid_px: (N, M) 매수1호가, 호가가 없으면 nan
+    :param bid_qty: (N, M) 매수1잔량
+    :param ask_px: (N, M) 매도1호가
+    :param ask_qty: (N, M) 매도1잔량
+    :param ex: (N,) 거래소별 변환 환율
+    """
+    ex = np.asarray(ex, dtype=np.float64)[:, None]
+    krw_buy = np.floor(np.asarray(ask_px, dtype=np.float64) * ex)  # (N, M)
+    krw_sll = np.floor(np.asarray(bid_px, dtype=np.float64) * ex)
+    n = krw_buy.shape[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pft = (krw_sll[None, :, :] - krw_buy[:, None, :]) / krw_buy[:, None, :]
+    pft[np.arange(n), np.arange(n)] = np.nan  # 같은 거래소
+    pft[~np.isfinite(pft)] = np.nan
+    buy = np.broadcast_to(np.asarray(ask_px, dtype=np.float64)[:, None, :],
+                          pft.shape)
+    sll = np.broadcast_to(np.asarray(bid_px, dtype=np.float64)[None, :, :],
+                          pft.shape)
+    qty = np.minimum(np.asarray(ask_qty, dtype=np.float64)[:, None, :],
+                     np.asarray(bid_qty, dtype=np.float64)[None, :, :])
+    return PremiumMatrix(buy, sll, qty, pft)
+
+
+def top_premiums(pm, k=10, min_qty=0.0, min_pft=None) -> np.ndarray:
+    """
+    수익률 상위 k 개 기회 (PREMIUM_DTYPE 레코드 배열, 수익률 내림차순)
+    :param pm: premium_matrix 결과
+    :param min_qty: 가능수량이 이보다 큰 것만
+    :param min_pft: 수익률이 이 이상인 것만
+    """
+    pft = pm.pft.ravel()
+    valid = ~np.isnan(pft) & (pm.qty.ravel() > min_qty)
+    if min_pft is not None:
+        valid &= pft >= min_pft
+    idx = np.flatnonzero(valid)
+    if len(idx) > k:
+        idx = idx[np.argpartition(-pft[idx], k - 1)[:k]]
+    idx = idx[np.argsort(-pft[idx], kind='stable')]
+    long_ex, short_ex, coin = np.unravel_index(idx, pm.pft.shape)
+    ret = np.empty(len(idx), dtype=PREMIUM_DTYPE)
+    ret['long'] = long_ex
+    ret['short'] = short_ex
+    ret['coin'] = coin
+    ret['buy'] = pm.buy[long_ex, short_ex, coin]
+    ret['sll'] = pm.sll[long_ex, short_ex, coin]
+    ret['qty'] = pm.qty.ravel()[idx]
+    ret['pft'] = pft[idx]
+    return ret
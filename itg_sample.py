@@ -25,7 +25,7 @@ def check_position(rs_api, position_json):
     global  G_FSM
     global  G_LEVERAGE
 
-    if position_json == None:
+    if not position_json:  # 포지션 없음
         return
 
     # reset
@@ -70,11 +70,13 @@ def main(apikey, secret):
         # 메인스레드에서 큐에서 데이터를 꺼냄( 블로킹모드 )
         txt = msg_q.get()
         # 데이터 스냅샷 저장( 내부적으로 JSON 형태로 변환)
-        rdata.put_message(txt)
+        # 반환값은 반영한 테이블 이름 (partial 전이라 버린 메시지는 None)
+        table = rdata.put_message(txt)
 
         if G_FSM == FSM_VAL.CHECK_POSITION:
-            if 'position' in  rdata.data :
-                check_position(rs_api, rdata.data['position'])
+            # position 메시지를 반영했을 때만 확인
+            if table == 'position':
+                check_position(rs_api, rdata.data.get('position'))
         elif G_FSM == FSM_VAL.CHECK_LINES:
             break
 